@@ -5,6 +5,7 @@ from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
 from datetime import datetime
 import hashlib
+import joblib
 from statsmodels.tsa.seasonal import seasonal_decompose
 import json
 
@@ -51,6 +52,8 @@ class AIModule:
         # Initialize ML components
         self.model = None
         self.label_encoder = LabelEncoder()
+        self.feature_names = None
+        self.model_version = None
         self.risk_factors = set()
         
         # Risk scoring thresholds
@@ -323,33 +326,43 @@ class AIModule:
             'historical_trends': self.analyze_trends(historical_data) if historical_data else None
         }
 
+    @staticmethod
+    def build_features(df):
+        """Add trend and clinical features to a frame of readings; returns the feature list"""
+        features = ['bmi', 'temp', 'systolic_bp', 'diastolic_bp', 'pulse', 'age']
+        
+        # Add time-series features if available
+        if 'date' in df.columns:
+            df['date'] = pd.to_datetime(df['date'])
+            if 'registration_id' in df.columns:
+                # Trends are computed within each patient's own readings
+                df.sort_values(['registration_id', 'date'], inplace=True, kind='stable')
+                grouped = df.groupby('registration_id', sort=False)
+                df['bp_trend'] = grouped['systolic_bp'].transform(lambda s: s.rolling(window=3, min_periods=1).mean())
+                df['bmi_trend'] = grouped['bmi'].transform(lambda s: s.rolling(window=3, min_periods=1).mean())
+            else:
+                df.sort_values('date', inplace=True)
+                df['bp_trend'] = df['systolic_bp'].rolling(window=3).mean()
+                df['bmi_trend'] = df['bmi'].rolling(window=3).mean()
+            
+            features.extend(['bp_trend', 'bmi_trend'])
+        
+        # Add clinical features
+        if 'comorbidities' in df.columns:
+            df['comorbidity_count'] = df['comorbidities'].apply(lambda x: len(json.loads(x)) if isinstance(x, str) and x else 0)
+            features.append('comorbidity_count')
+        
+        if 'medications' in df.columns:
+            df['medication_count'] = df['medications'].apply(lambda x: len(json.loads(x)) if isinstance(x, str) and x else 0)
+            features.append('medication_count')
+        
+        return features
+
     def train_ml_model(self, data_path):
         """Enhanced ML model training with time-series features"""
         try:
             df = pd.read_excel(data_path)
-            
-            # Basic features
-            features = ['bmi', 'temp', 'systolic_bp', 'diastolic_bp', 'pulse', 'age']
-            
-            # Add time-series features if available
-            if 'date' in df.columns:
-                df['date'] = pd.to_datetime(df['date'])
-                df = df.sort_values('date')
-                
-                # Calculate trends
-                df['bp_trend'] = df['systolic_bp'].rolling(window=3).mean()
-                df['bmi_trend'] = df['bmi'].rolling(window=3).mean()
-                
-                features.extend(['bp_trend', 'bmi_trend'])
-            
-            # Add clinical features
-            if 'comorbidities' in df.columns:
-                df['comorbidity_count'] = df['comorbidities'].apply(lambda x: len(json.loads(x)) if isinstance(x, str) else 0)
-                features.append('comorbidity_count')
-            
-            if 'medications' in df.columns:
-                df['medication_count'] = df['medications'].apply(lambda x: len(json.loads(x)) if isinstance(x, str) else 0)
-                features.append('medication_count')
+            features = self.build_features(df)
             
             X = df[features].fillna(0)
             y = self.label_encoder.fit_transform(df['disease'])
@@ -362,10 +375,12 @@ class AIModule:
                 max_depth=12,
                 min_samples_split=5,
                 min_samples_leaf=2,
-                random_state=42
+                random_state=42,
+                n_jobs=-1
             )
             
             self.model.fit(X_train, y_train)
+            self.feature_names = features
             
             # Calculate feature importance
             feature_importance = pd.DataFrame({
@@ -379,7 +394,25 @@ class AIModule:
             print(f"Error training model: {str(e)}")
             return None
 
-    def predict_disease(self, patient_data):
+    def save_model(self, path, **metadata):
+        """Persist the trained model, label encoder and feature order"""
+        joblib.dump({
+            'model': self.model,
+            'label_encoder': self.label_encoder,
+            'feature_names': self.feature_names,
+            **metadata
+        }, path)
+
+    def load_model(self, path):
+        """Load a model saved with save_model"""
+        bundle = joblib.load(path)
+        self.model = bundle['model']
+        self.label_encoder = bundle['label_encoder']
+        self.feature_names = bundle['feature_names']
+        self.model_version = bundle.get('version')
+        return bundle
+
+    def predict_disease(self, patient_data, historical_data=None):
         """Enhanced disease prediction with differential diagnosis"""
         if not self.model:
             return "ML model not trained."
@@ -396,10 +429,19 @@ class AIModule:
             }
             
             # Add trend features if available
-            if 'historical_data' in patient_data:
+            if historical_data:
+                # Same 3-reading window as training: this reading plus the two before it
+                recent = historical_data[:2]
+                features['bp_trend'] = float(np.mean([patient_data['systolic_bp']] + [r['systolic_bp'] for r in recent]))
+                features['bmi_trend'] = float(np.mean([features['bmi']] + [r['bmi'] for r in recent]))
+            elif 'historical_data' in patient_data:
                 historical_df = pd.DataFrame(patient_data['historical_data'])
                 features['bp_trend'] = historical_df['systolic_bp'].mean()
                 features['bmi_trend'] = historical_df['bmi'].mean()
+            else:
+                # First reading: training's rolling window (min_periods=1) is the reading itself
+                features['bp_trend'] = float(patient_data['systolic_bp'])
+                features['bmi_trend'] = float(features['bmi'])
             
             # Add clinical features if available
             if 'comorbidities' in patient_data:
@@ -407,8 +449,11 @@ class AIModule:
             if 'medications' in patient_data:
                 features['medication_count'] = len(patient_data['medications'])
             
-            # Make prediction
-            X = np.array([list(features.values())])
+            # Make prediction, in the column order the model was trained with
+            if self.feature_names:
+                X = np.array([[features.get(name, 0) for name in self.feature_names]])
+            else:
+                X = np.array([list(features.values())])
             probabilities = self.model.predict_proba(X)[0]
             
             # Get top 3 predictions
@@ -0,0 +1,223 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from ai_module import AIModule
+from retrain import CURRENT_POINTER, current_model_path
+
+# AIModule instance owned by each worker process, built once by _init_worker
+_worker_ai = None
+_model_dir = None
+_model_mtime = None
+
+
+def _refresh_model():
+    """Load the published model if retrain.py has published a new version"""
+    global _model_mtime
+    if not _model_dir:
+        return
+    try:
+        mtime = os.stat(os.path.join(_model_dir, CURRENT_POINTER)).st_mtime
+    except OSError:
+        return
+    if mtime == _model_mtime:
+        return
+    _model_mtime = mtime
+    try:
+        _worker_ai.load_model(current_model_path(_model_dir))
+    except Exception as e:
+        print(f"Error loading published model: {e}")
+
+
+def _init_worker(model_data_path, model_dir):
+    global _worker_ai, _model_dir
+    _worker_ai = AIModule()
+    _model_dir = model_dir
+    if model_data_path:
+        _worker_ai.train_ml_model(model_data_path)
+    _refresh_model()
+
+
+def _warm_up():
+    """No-op task that makes the pool start a worker (running _init_worker)"""
+    return os.getpid()
+
+
+def _run_analysis(patient_data, historical_data, submitted_at):
+    """Trend-aware risk scoring and disease prediction, run inside a worker"""
+    started_at = time.time()
+    _refresh_model()
+    risk_assessment = _worker_ai.calculate_risk_score(patient_data, historical_data)
+    disease_prediction = _worker_ai.predict_disease(patient_data, historical_data)
+    return {
+        'risk_assessment': risk_assessment,
+        'disease_prediction': disease_prediction,
+        'queue_wait': max(started_at - submitted_at, 0.0),
+        'run_time': time.time() - started_at,
+    }
+
+
+class AnalysisQueueFull(Exception):
+    """Raised when the analysis pool already has the maximum number of pending tasks"""
+
+    def __init__(self, retry_after):
+        super().__init__('Analysis queue is full')
+        self.retry_after = retry_after
+
+
+class _Timing:
+    """Count/total/max plus a window of recent samples for percentiles"""
+
+    def __init__(self, window=1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def snapshot(self):
+        recent = sorted(self.recent)
+
+        def percentile(p):
+            if not recent:
+                return 0.0
+            return round(recent[min(int(len(recent) * p), len(recent) - 1)], 4)
+
+        return {
+            'count': self.count,
+            'avg': round(self.total / self.count, 4) if self.count else 0.0,
+            'max': round(self.max, 4),
+            'p50': percentile(0.50),
+            'p95': percentile(0.95),
+        }
+
+
+class AnalysisExecutor:
+    """Bounded process pool for the expensive parts of AIModule analysis.
+
+    At most ``max_pending`` tasks may be queued or running; beyond that
+    ``analyze`` raises AnalysisQueueFull so the caller can shed load. A task
+    that misses its ``timeout`` deadline yields None and the caller falls back
+    to rules-only output.
+    """
+
+    def __init__(self, workers, max_pending, timeout, retry_after=1, model_data_path=None, model_dir=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.model_data_path = model_data_path
+        self.model_dir = model_dir
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._metrics_lock = threading.Lock()
+        self._counters = {'submitted': 0, 'completed': 0, 'timeouts': 0, 'rejected': 0, 'failed': 0}
+        self._pending = 0
+        self._queue_wait = _Timing()
+        self._run_time = _Timing()
+
+    def start(self):
+        """Start every worker and wait for their initializers, so the first
+        submissions do not pay process startup and model loading"""
+        pool = self._get_pool()
+        try:
+            warm_ups = [pool.submit(_warm_up) for _ in range(self.workers)]
+            pids = {future.result() for future in warm_ups}
+            print(f"Analysis pool started with {len(pids)} warm worker(s)")
+        except Exception as e:
+            print(f"Error starting analysis workers: {e}")
+            self._reset_pool()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=_init_worker,
+                    initargs=(self.model_data_path, self.model_dir)
+                )
+            return self._pool
+
+    def _reset_pool(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _count(self, name, delta=1):
+        with self._metrics_lock:
+            self._counters[name] += delta
+
+    def _release(self, future):
+        with self._metrics_lock:
+            self._pending -= 1
+            # Timed here rather than in analyze() so tasks that missed their deadline count too
+            if future is not None and not future.cancelled() and future.exception() is None:
+                result = future.result()
+                self._queue_wait.add(result['queue_wait'])
+                self._run_time.add(result['run_time'])
+        self._slots.release()
+
+    def analyze(self, patient_data, historical_data=None):
+        """Return the worker's analysis, or None if it failed or missed its deadline"""
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise AnalysisQueueFull(self.retry_after)
+        with self._metrics_lock:
+            self._pending += 1
+            self._counters['submitted'] += 1
+
+        try:
+            future = self._get_pool().submit(_run_analysis, patient_data, historical_data, time.time())
+        except Exception as e:
+            print(f"Error submitting analysis task: {e}")
+            self._count('failed')
+            self._release(None)
+            self._reset_pool()
+            return None
+        # The slot is only freed once the worker is actually done with the task
+        future.add_done_callback(self._release)
+
+        try:
+            result = future.result(timeout=self.timeout)
+        except FuturesTimeout:
+            # Drop it if it never left the queue; a running task finishes in the background
+            future.cancel()
+            self._count('timeouts')
+            return None
+        except BrokenProcessPool as e:
+            print(f"Analysis worker crashed: {e}")
+            self._count('failed')
+            self._reset_pool()
+            return None
+        except Exception as e:
+            print(f"Error in analysis task: {e}")
+            self._count('failed')
+            return None
+
+        self._count('completed')
+        return {key: value for key, value in result.items() if key not in ('queue_wait', 'run_time')}
+
+    def metrics(self):
+        with self._metrics_lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'timeout': self.timeout,
+                'pending': self._pending,
+                **self._counters,
+                'queue_wait_seconds': self._queue_wait.snapshot(),
+                'run_time_seconds': self._run_time.snapshot(),
+            }
+
+    def shutdown(self):
+        self._reset_pool()
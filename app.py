@@ -1,31 +1,112 @@
-from flask import Flask, render_template, request, jsonify, flash, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response, send_file, session, stream_with_context
 import mysql.connector
 from config import Config
 from ai_module import AIModule
+from analysis_pool import AnalysisExecutor, AnalysisQueueFull
+from sharding import shards
+from dashboard import PATIENT_SORTS, PATIENT_STATUSES, merge_patient_pages
+from patient_cache import PatientCache
+from profiling import RequestProfiler
+import export
+import snapshots
 import pandas as pd
 from datetime import datetime
 import json
+import os
+import tempfile
+import time
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # Change this to a secure secret key
+# Opt-in request profiling (no hooks are installed unless configured)
+RequestProfiler(
+    directory=Config.PROFILE_DIR,
+    max_profiles=Config.PROFILE_MAX_PROFILES,
+    sample_rate=Config.PROFILE_SAMPLE_RATE,
+    admin_token=Config.PROFILE_ADMIN_TOKEN,
+    sample_interval=Config.PROFILE_SAMPLE_INTERVAL
+).init_app(app)
 ai = AIModule()
+# Trend analysis and ML prediction run here, off the request threads
+analysis_executor = AnalysisExecutor(
+    workers=Config.ANALYSIS_WORKERS,
+    max_pending=Config.ANALYSIS_MAX_PENDING,
+    timeout=Config.ANALYSIS_TIMEOUT,
+    retry_after=Config.ANALYSIS_RETRY_AFTER,
+    model_data_path=Config.ANALYSIS_MODEL_DATA,
+    model_dir=Config.MODEL_DIR
+)
+
+patient_cache = PatientCache(max_entries=Config.PATIENT_CACHE_SIZE, ttl=Config.PATIENT_CACHE_TTL)
 
 # Database connection
-def get_db_connection():
+def get_db_connection(read_only=False, registration_id=None, shard=None):
+    """Open a connection to the shard owning registration_id (or the named shard);
+    read-only callers may be routed to one of its replicas"""
     try:
-        return mysql.connector.connect(
-            host=Config.MYSQL_HOST,
-            user=Config.MYSQL_USER,
-            password=Config.MYSQL_PASSWORD,
-            database=Config.MYSQL_DB
-        )
+        shard_router = shards.routers[shard] if shard else shards.router_for(registration_id)
+        if read_only:
+            return shard_router.connect_read(registration_id, pin_primary=primary_pinned())
+        return shard_router.connect_primary()
     except mysql.connector.Error as err:
         print(f"Database connection error: {err}")
         return None
 
+def primary_pinned():
+    """Read your own writes: stay on the primary shortly after this session submitted"""
+    return session.get('primary_until', 0) > time.time()
+
+def scatter_read(query):
+    """Run query(cursor, shard) on every shard in parallel; returns {shard: result}"""
+    pin_primary = primary_pinned()
+    
+    def run(shard, shard_router):
+        conn = shard_router.connect_read(pin_primary=pin_primary)
+        cursor = conn.cursor(dictionary=True)
+        try:
+            return query(cursor, shard)
+        finally:
+            cursor.close()
+            conn.close()
+    
+    return shards.scatter(run)
+
+def ensure_index(cursor, table, index_name, columns):
+    """Create an index on an existing table if it is not there yet"""
+    cursor.execute('''
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    ''', (table, index_name))
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"CREATE INDEX {index_name} ON {table} ({columns})")
+
+def drop_index(cursor, table, index_name):
+    """Drop an index from an existing table if it is there"""
+    cursor.execute('''
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    ''', (table, index_name))
+    if cursor.fetchone()[0] > 0:
+        cursor.execute(f"DROP INDEX {index_name} ON {table}")
+
+def ensure_column(cursor, table, column, definition):
+    """Add a column to an existing table; returns True if it was added"""
+    cursor.execute('''
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    ''', (table, column))
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
+
 # Initialize database tables
 def init_db():
-    conn = get_db_connection()
+    for shard in shards.names:
+        init_shard_db(shard)
+
+def init_shard_db(shard):
+    conn = get_db_connection(shard=shard)
     if conn:
         cursor = conn.cursor()
         try:
@@ -34,9 +115,7 @@ def init_db():
                 CREATE TABLE IF NOT EXISTS vital_signs (
                     id INT AUTO_INCREMENT PRIMARY KEY,
                     registration_id VARCHAR(50) NOT NULL,
-                    name VARCHAR(100) NOT NULL,
-                    gender ENUM('MALE', 'FEMALE') NOT NULL,
-                    age INT NOT NULL,
+                    snapshot_id INT NULL,
                     date DATE NOT NULL,
                     time TIME NOT NULL,
                     height FLOAT NOT NULL,
@@ -52,9 +131,25 @@ def init_db():
                     recommendations TEXT NOT NULL,
                     risk_score FLOAT,
                     risk_level ENUM('LOW', 'MODERATE', 'HIGH', 'CRITICAL'),
+                    diagnosis VARCHAR(100) NULL,
+                    diagnosis_updated_at TIMESTAMP(6) NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Point-in-time demographics, written only when they change
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS patient_snapshots (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    registration_id VARCHAR(50) NOT NULL,
+                    name VARCHAR(100) NOT NULL,
+                    gender ENUM('MALE', 'FEMALE') NOT NULL,
+                    age INT NOT NULL,
                     comorbidities JSON,
                     medications JSON,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    fingerprint CHAR(64) NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_patient_snapshots_fingerprint (registration_id, fingerprint)
                 )
             ''')
             
@@ -69,23 +164,82 @@ def init_db():
                     medications JSON,
                     last_risk_score FLOAT,
                     last_risk_level ENUM('LOW', 'MODERATE', 'HIGH', 'CRITICAL'),
+                    last_vital_id INT NULL,
+                    last_vital_at TIMESTAMP NULL,
+                    last_status ENUM('critical', 'warning', 'normal'),
+                    snapshot_id INT NULL,
+                    version INT NOT NULL DEFAULT 1,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
                 )
             ''')
             
+            # Indexes for range exports
+            ensure_index(cursor, 'vital_signs', 'idx_vital_signs_date', 'date')
+            ensure_index(cursor, 'vital_signs', 'idx_vital_signs_registration', 'registration_id, id')
+            
+            # Pointer to each patient's latest reading so the dashboard avoids a MAX() scan
+            added = ensure_column(cursor, 'patients', 'last_vital_id', 'INT NULL')
+            ensure_column(cursor, 'patients', 'last_vital_at', 'TIMESTAMP NULL')
+            ensure_column(cursor, 'patients', 'last_status', "ENUM('critical', 'warning', 'normal')")
+            if added:
+                cursor.execute('''
+                    UPDATE patients p
+                    JOIN (
+                        SELECT registration_id, MAX(id) AS id
+                        FROM vital_signs
+                        GROUP BY registration_id
+                    ) latest ON latest.registration_id = p.registration_id
+                    JOIN vital_signs v ON v.id = latest.id
+                    SET p.last_vital_id = v.id,
+                        p.last_vital_at = v.created_at,
+                        p.last_status = CASE
+                            WHEN v.alerts LIKE '%Critical Alert%' THEN 'critical'
+                            WHEN v.alerts NOT IN ('', '[]') THEN 'warning'
+                            ELSE 'normal'
+                        END
+                ''')
+            ensure_index(cursor, 'patients', 'idx_patients_recent', 'last_vital_at, registration_id')
+            ensure_index(cursor, 'patients', 'idx_patients_name', 'name, registration_id')
+            # Descending columns so 'critical' (and 'recent' within a status) is an index scan
+            drop_index(cursor, 'patients', 'idx_patients_status')
+            ensure_index(cursor, 'patients', 'idx_patients_status_recent',
+                         'last_status, last_vital_at DESC, registration_id DESC')
+            
+            # Demographics moved out of vital_signs; legacy columns stay nullable until
+            # `python snapshots.py --drop-columns` has backfilled and dropped them
+            ensure_column(cursor, 'vital_signs', 'snapshot_id', 'INT NULL')
+            ensure_column(cursor, 'patients', 'snapshot_id', 'INT NULL')
+            # Bumped on every demographic change so cached patient rows can be revalidated
+            ensure_column(cursor, 'patients', 'version', 'INT NOT NULL DEFAULT 1')
+            
+            # Confirmed diagnosis for a reading; the training label for retrain.py
+            ensure_column(cursor, 'vital_signs', 'diagnosis', 'VARCHAR(100) NULL')
+            # Lets retrain.py notice relabelled readings without scanning vital_signs
+            ensure_column(cursor, 'vital_signs', 'diagnosis_updated_at', 'TIMESTAMP(6) NULL')
+            ensure_index(cursor, 'vital_signs', 'idx_vital_signs_diagnosis_updated', 'diagnosis_updated_at')
+            # Relaxing NOT NULL on the legacy columns rebuilds vital_signs, so it is left to
+            # `python snapshots.py --prepare` rather than run on every startup
+            required = snapshots.legacy_required_columns(cursor)
+            if required:
+                print(f"Shard {shard}: vital_signs.{', '.join(required)} still NOT NULL; "
+                      "run `python snapshots.py --prepare` before accepting submissions")
+            
             conn.commit()
         except mysql.connector.Error as err:
-            print(f"Error creating tables: {err}")
+            print(f"Error creating tables on shard {shard}: {err}")
         finally:
             cursor.close()
             conn.close()
 
 # Initialize database on startup
 init_db()
+# Start the analysis workers now rather than on the first submission
+analysis_executor.start()
 
 # Load and train ML model (optional for MVP)
 # ai.train_ml_model('vital_signs_disease_dataset_1000.xlsx')
+# Analysis workers load the model published by `python retrain.py` from Config.MODEL_DIR
 
 @app.route('/')
 def index():
@@ -93,68 +247,134 @@ def index():
 
 @app.route('/doctor')
 def doctor_dashboard():
+    # Patients are fetched page by page from /api/patients by doctor.js
+    return render_template('doctor_dashboard.html')
+
+def alert_status(alerts):
+    """Map a reading's alerts to the dashboard status used for filtering"""
+    if any('Critical Alert' in alert for alert in alerts):
+        return 'critical'
+    return 'warning' if alerts else 'normal'
+
+def prepare_dashboard_patient(patient):
+    """Decode stored JSON and fill in a missing summary for a dashboard row"""
     try:
-        conn = get_db_connection()
-        if not conn:
-            flash('Database connection error', 'error')
-            return render_template('doctor_dashboard.html', patients=[])
-        
-        cursor = conn.cursor(dictionary=True)
-        
-        # Get latest vital signs for each patient
-        cursor.execute('''
-            SELECT v.*, p.name, p.gender, p.age
-            FROM vital_signs v
-            JOIN patients p ON v.registration_id = p.registration_id
-            WHERE v.created_at IN (
-                SELECT MAX(created_at)
-                FROM vital_signs
-                GROUP BY registration_id
-            )
-            ORDER BY v.created_at DESC
-        ''')
-        
-        patients = cursor.fetchall()
-        
-        # Process patient data for display
-        for patient in patients:
-            try:
-                patient['alerts'] = json.loads(patient['alerts']) if patient['alerts'] else []
-            except Exception:
-                patient['alerts'] = []
-            # Convert alerts from list of dicts to list of strings if needed
-            if patient['alerts'] and isinstance(patient['alerts'][0], dict) and 'text' in patient['alerts'][0]:
-                patient['alerts'] = [a['text'] for a in patient['alerts']]
-            try:
-                patient['recommendations'] = json.loads(patient['recommendations']) if patient['recommendations'] else []
-            except Exception:
-                patient['recommendations'] = []
-            # Ensure summary is always present and correct
-            if not patient.get('summary') or not patient['summary'].strip() or patient['summary'].strip().lower() == 'no summary available.':
-                # Regenerate summary from latest vitals if missing or placeholder
-                try:
-                    patient['summary'] = ai.generate_summary({
-                        'name': patient.get('name', ''),
-                        'age': patient.get('age', 0),
-                        'gender': patient.get('gender', ''),
-                        'height': patient.get('height', 0),
-                        'weight': patient.get('weight', 0),
-                        'systolic_bp': patient.get('systolic_bp', 0),
-                        'diastolic_bp': patient.get('diastolic_bp', 0),
-                        'temp': patient.get('temp', 0),
-                        'pulse': patient.get('pulse', 0)
-                    })
-                except Exception as e:
-                    print(f"[DEBUG] Failed to regenerate summary for patient {patient.get('registration_id')}: {e}")
-                    patient['summary'] = 'No summary available.'
+        patient['alerts'] = json.loads(patient['alerts']) if patient['alerts'] else []
+    except Exception:
+        patient['alerts'] = []
+    # Convert alerts from list of dicts to list of strings if needed
+    if patient['alerts'] and isinstance(patient['alerts'][0], dict) and 'text' in patient['alerts'][0]:
+        patient['alerts'] = [a['text'] for a in patient['alerts']]
+    try:
+        patient['recommendations'] = json.loads(patient['recommendations']) if patient['recommendations'] else []
+    except Exception:
+        patient['recommendations'] = []
+    # Ensure summary is always present and correct
+    if not patient.get('summary') or not patient['summary'].strip() or patient['summary'].strip().lower() == 'no summary available.':
+        # Regenerate summary from latest vitals if missing or placeholder
+        try:
+            patient['summary'] = ai.generate_summary({
+                'name': patient.get('name', ''),
+                'age': patient.get('age', 0),
+                'gender': patient.get('gender', ''),
+                'height': patient.get('height', 0),
+                'weight': patient.get('weight', 0),
+                'systolic_bp': patient.get('systolic_bp', 0),
+                'diastolic_bp': patient.get('diastolic_bp', 0),
+                'temp': patient.get('temp', 0),
+                'pulse': patient.get('pulse', 0)
+            })
+        except Exception as e:
+            print(f"[DEBUG] Failed to regenerate summary for patient {patient.get('registration_id')}: {e}")
+            patient['summary'] = 'No summary available.'
+    if patient.get('last_vital_at'):
+        patient['last_vital_at'] = patient['last_vital_at'].strftime('%Y-%m-%d %H:%M')
+    return patient
+
+@app.route('/api/patients')
+def api_patients():
+    search = request.args.get('q', '').strip()
+    status = request.args.get('status', 'all')
+    sort = request.args.get('sort', 'recent')
+    if sort not in PATIENT_SORTS:
+        return jsonify({'error': f'Unsupported sort: {sort}'}), 400
+    if status != 'all' and status not in PATIENT_STATUSES:
+        return jsonify({'error': f'Unsupported status: {status}'}), 400
+    try:
+        page = max(int(request.args.get('page', 0)), 0)
+        page_size = min(max(int(request.args.get('page_size', Config.PATIENTS_PAGE_SIZE)), 1), Config.PATIENTS_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'page and page_size must be integers'}), 400
+    
+    conditions = ['p.last_vital_id IS NOT NULL']
+    params = []
+    if search:
+        # Prefix match so the name index and primary key can be used
+        conditions.append('(p.name LIKE %s OR p.registration_id LIKE %s)')
+        prefix = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        params.extend([prefix, prefix])
+    if status != 'all':
+        conditions.append('p.last_status = %s')
+        params.append(status)
+    where = ' AND '.join(conditions)
+    
+    # With one shard the database pages directly; with several, each shard returns
+    # its first (page + 1) pages and the merged result is sliced here
+    if len(shards.active) == 1:
+        limit, offset = page_size, page * page_size
+    else:
+        limit, offset = (page + 1) * page_size, 0
+    
+    def query(cursor, shard):
+        # The count is only needed once per search; later pages are fetched while scrolling
+        total = None
+        if page == 0 and len(shards.active) == 1:
+            cursor.execute(f'SELECT COUNT(*) AS total FROM patients p WHERE {where}', params)
+            total = cursor.fetchone()['total']
+        elif page == 0:
+            # During a rebalance moved patients are on two shards; only the owner's copy counts.
+            # Reads the same index as COUNT(*)
+            cursor.execute(f'SELECT p.registration_id FROM patients p WHERE {where}', params)
+            total = sum(1 for row in cursor.fetchall() if shards.owns(shard, row['registration_id']))
         
-        cursor.close()
-        conn.close()
+        rows = []
+        fetch_offset = offset
+        while True:
+            cursor.execute(f'''
+                SELECT p.registration_id, p.name, p.gender, p.age,
+                       p.last_status AS status, p.last_vital_at,
+                       v.height, v.weight, v.bmi, v.temp, v.systolic_bp, v.diastolic_bp, v.pulse,
+                       v.risk_score, v.risk_level, v.summary, v.alerts, v.recommendations
+                FROM patients p
+                JOIN vital_signs v ON v.id = p.last_vital_id
+                WHERE {where}
+                ORDER BY {PATIENT_SORTS[sort]}
+                LIMIT %s OFFSET %s
+            ''', params + [limit, fetch_offset])
+            fetched = cursor.fetchall()
+            rows.extend(row for row in fetched if shards.owns(shard, row['registration_id']))
+            # Keep reading past skipped copies until the shard has filled its share
+            if len(fetched) < limit or len(rows) >= limit:
+                return total, rows[:limit]
+            fetch_offset += limit
+    
+    try:
+        results = scatter_read(query)
+        total = sum(shard_total for shard_total, _ in results.values()) if page == 0 else None
+        if len(results) > 1:
+            rows = merge_patient_pages([shard_rows for _, shard_rows in results.values()], sort, page, page_size)
+        else:
+            rows = next(iter(results.values()))[1]
+        patients = [prepare_dashboard_patient(patient) for patient in rows]
         
-        return render_template('doctor_dashboard.html', patients=patients)
+        return jsonify({
+            'patients': patients,
+            'total': total,
+            'page': page,
+            'page_size': page_size
+        })
     except Exception as e:
-        flash(f'Error loading dashboard: {str(e)}', 'error')
-        return render_template('doctor_dashboard.html', patients=[])
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/submit_vitals', methods=['POST'])
 def submit_vitals():
@@ -182,8 +402,8 @@ def submit_vitals():
         if missing_fields:
             return jsonify({'error': f'Missing required fields: {", ".join(missing_fields)}'}), 400
         
-        # Get historical data for trend analysis
-        conn = get_db_connection()
+        # Get historical data for trend analysis from the shard that owns this patient
+        conn = get_db_connection(registration_id=data['registration_id'])
         if not conn:
             return jsonify({'error': 'Database connection error'}), 500
         
@@ -198,14 +418,23 @@ def submit_vitals():
             ''', (data['registration_id'],))
             historical_data = cursor.fetchall()
             
-            # Generate comprehensive analysis
+            # Rule-based analysis is cheap and runs inline
             bmi = ai.calculate_bmi(data['height'], data['weight'])
             summary = ai.generate_summary(data)
-            risk_assessment = ai.calculate_risk_score(data, historical_data)
             alerts = ai.generate_alerts(data)
             recommendations = ai.generate_recommendations(data)
-            dashboard_data = ai.generate_dashboard_data(data, historical_data)
-            print(f"Generated analysis: {dashboard_data}")  # Debug log
+            
+            # Trend-aware risk and disease prediction run on the analysis pool;
+            # if they miss the deadline, fall back to rules-only risk scoring
+            analysis = analysis_executor.analyze(data, historical_data)
+            analysis_degraded = analysis is None
+            if analysis_degraded:
+                risk_assessment = ai.calculate_risk_score(data)
+                disease_prediction = None
+            else:
+                risk_assessment = analysis['risk_assessment']
+                disease_prediction = analysis['disease_prediction']
+            print(f"Generated analysis: {analysis}")  # Debug log
             
             # Convert lists to JSON strings for database storage
             alerts_json = json.dumps(alerts)
@@ -213,38 +442,29 @@ def submit_vitals():
             comorbidities_json = json.dumps(data.get('comorbidities', []))
             medications_json = json.dumps(data.get('medications', []))
             
-            # Insert or update patient record
-            cursor.execute('''
-                INSERT INTO patients (
-                    registration_id, name, gender, age,
-                    comorbidities, medications, last_risk_score, last_risk_level
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE
-                name = VALUES(name),
-                gender = VALUES(gender),
-                age = VALUES(age),
-                comorbidities = VALUES(comorbidities),
-                medications = VALUES(medications),
-                last_risk_score = VALUES(last_risk_score),
-                last_risk_level = VALUES(last_risk_level)
-            ''', (
-                data['registration_id'], data['name'], data['gender'], data['age'],
-                comorbidities_json,
-                medications_json,
-                risk_assessment['score'],
-                risk_assessment['level']
-            ))
+            # Cached patient row (with its snapshot fingerprint) decides whether
+            # demographics changed since the last reading
+            patient = patient_cache.lookup(cursor, data['registration_id'])
+            current_snapshot_id = patient['snapshot_id'] if patient else None
+            current_fingerprint = patient['snapshot_fingerprint'] if patient else None
             
-            # Insert vital signs with enhanced data
+            # Record a demographics snapshot only if they differ from the current one
+            snapshot_id, demographics_changed = snapshots.ensure_snapshot(
+                cursor, data['registration_id'], data['name'], data['gender'], data['age'],
+                data.get('comorbidities', []), data.get('medications', []),
+                current_id=current_snapshot_id, current_fingerprint=current_fingerprint or ''
+            )
+            
+            # Insert vital signs; demographics live in the referenced snapshot
             cursor.execute('''
                 INSERT INTO vital_signs (
-                    registration_id, name, gender, age, date, time,
+                    registration_id, snapshot_id, date, time,
                     height, weight, bmi, temp, systolic_bp, diastolic_bp,
                     pulse, pain_scale, summary, alerts, recommendations,
-                    risk_score, risk_level, comorbidities, medications
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    risk_score, risk_level
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             ''', (
-                data['registration_id'], data['name'], data['gender'], data['age'],
+                data['registration_id'], snapshot_id,
                 data['date'], data['time'], data['height'], data['weight'],
                 bmi, data['temp'], data['systolic_bp'], data['diastolic_bp'],
                 data['pulse'], data['pain_scale'],
@@ -252,14 +472,81 @@ def submit_vitals():
                 alerts_json,
                 recommendations_json,
                 risk_assessment['score'],
-                risk_assessment['level'],
-                comorbidities_json,
-                medications_json
+                risk_assessment['level']
             ))
+            vital_id = cursor.lastrowid
+            status = alert_status(alerts)
+            # Written explicitly (not NOW()) so the cached row can carry the same value
+            vital_at = datetime.now().replace(microsecond=0)
+            
+            risk_only = False
+            if patient and not demographics_changed:
+                # Only the risk fields and latest-reading pointer changed; the version
+                # guard catches demographics updated by another worker in the meantime.
+                # last_vital_id always changes, so a matched row is always an affected row.
+                cursor.execute('''
+                    UPDATE patients
+                    SET last_risk_score = %s, last_risk_level = %s,
+                        last_vital_id = %s, last_vital_at = %s, last_status = %s
+                    WHERE registration_id = %s AND version = %s
+                ''', (
+                    risk_assessment['score'], risk_assessment['level'],
+                    vital_id, vital_at, status, data['registration_id'], patient['version']
+                ))
+                risk_only = cursor.rowcount == 1
+            
+            if not risk_only:
+                # Insert or update patient record
+                cursor.execute('''
+                    INSERT INTO patients (
+                        registration_id, name, gender, age,
+                        comorbidities, medications, last_risk_score, last_risk_level, snapshot_id,
+                        last_vital_id, last_vital_at, last_status
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                    name = VALUES(name),
+                    gender = VALUES(gender),
+                    age = VALUES(age),
+                    comorbidities = VALUES(comorbidities),
+                    medications = VALUES(medications),
+                    last_risk_score = VALUES(last_risk_score),
+                    last_risk_level = VALUES(last_risk_level),
+                    snapshot_id = VALUES(snapshot_id),
+                    last_vital_id = VALUES(last_vital_id),
+                    last_vital_at = VALUES(last_vital_at),
+                    last_status = VALUES(last_status),
+                    version = version + 1
+                ''', (
+                    data['registration_id'], data['name'], data['gender'], data['age'],
+                    comorbidities_json,
+                    medications_json,
+                    risk_assessment['score'],
+                    risk_assessment['level'],
+                    snapshot_id,
+                    vital_id,
+                    vital_at,
+                    status
+                ))
             
             conn.commit()
             print("Data successfully saved to database")  # Debug log
             
+            if risk_only:
+                patient_cache.update(
+                    data['registration_id'],
+                    last_risk_score=risk_assessment['score'],
+                    last_risk_level=risk_assessment['level'],
+                    last_vital_id=vital_id,
+                    last_vital_at=vital_at,
+                    last_status=status
+                )
+            else:
+                patient_cache.invalidate(data['registration_id'])
+            
+            # Keep this patient and this session on the primary until replicas catch up
+            shards.router_for(data['registration_id']).record_write(data['registration_id'])
+            session['primary_until'] = time.time() + Config.READ_YOUR_WRITES_SECONDS
+            
             # Prepare response data
             response_data = {
                 'vitals': {
@@ -271,10 +558,16 @@ def submit_vitals():
                 'summary': summary,
                 'alerts': alerts,
                 'recommendations': recommendations,
-                'risk_assessment': risk_assessment
+                'risk_assessment': risk_assessment,
+                'disease_prediction': disease_prediction,
+                'analysis_degraded': analysis_degraded
             }
             
             return jsonify(response_data)
+        except AnalysisQueueFull as e:
+            conn.rollback()
+            print("Analysis queue full, rejecting submission")  # Debug log
+            return jsonify({'error': 'Server busy, please retry shortly'}), 503, {'Retry-After': str(e.retry_after)}
         except mysql.connector.Error as err:
             conn.rollback()
             print(f"Database error: {str(err)}")  # Debug log
@@ -293,27 +586,38 @@ def submit_vitals():
 @app.route('/patient_history/<registration_id>')
 def patient_history(registration_id):
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(read_only=True, registration_id=registration_id)
         if not conn:
             return jsonify({'error': 'Database connection error'}), 500
         
         cursor = conn.cursor(dictionary=True)
         
-        # Get patient info
-        cursor.execute('''
-            SELECT * FROM patients
-            WHERE registration_id = %s
-        ''', (registration_id,))
-        patient_info = cursor.fetchone()
+        # Get patient info; rows read here may come from a replica, so they are cached
+        # unverified, and a request pinned to the primary skips the cached row
+        pinned = primary_pinned() or shards.router_for(registration_id).is_pinned(registration_id)
+        patient_info = patient_cache.read(cursor, registration_id, bypass=pinned)
         
         if not patient_info:
             return jsonify({'error': 'Patient not found'}), 404
+        patient_info.pop('snapshot_fingerprint', None)
         
-        # Get vital signs history
-        cursor.execute('''
-            SELECT * FROM vital_signs
-            WHERE registration_id = %s
-            ORDER BY created_at DESC
+        # Get vital signs history with the demographics recorded at each reading;
+        # rows not yet backfilled into snapshots use their legacy columns while those exist
+        legacy = snapshots.legacy_columns_cached(cursor, shards.shard_for(registration_id))
+        demographics = ',\n                   '.join(
+            f'{expr} AS {column}' for column, expr in snapshots.demographic_expressions(legacy).items()
+        )
+        cursor.execute(f'''
+            SELECT v.id, v.registration_id, v.snapshot_id, v.date, v.time,
+                   v.height, v.weight, v.bmi, v.temp, v.systolic_bp, v.diastolic_bp,
+                   v.pulse, v.pain_scale, v.summary, v.alerts, v.recommendations,
+                   v.risk_score, v.risk_level, v.created_at,
+                   {demographics}
+            FROM vital_signs v
+            JOIN patients p ON p.registration_id = v.registration_id
+            LEFT JOIN patient_snapshots s ON s.id = v.snapshot_id
+            WHERE v.registration_id = %s
+            ORDER BY v.created_at DESC
         ''', (registration_id,))
         
         history = cursor.fetchall()
@@ -355,5 +659,100 @@ def patient_history(registration_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/patient/<registration_id>/vital_signs/<int:vital_id>/diagnosis', methods=['POST'])
+def record_diagnosis(registration_id, vital_id):
+    if not request.is_json:
+        return jsonify({'error': 'Request must be JSON'}), 400
+    diagnosis = (request.get_json() or {}).get('diagnosis')
+    if diagnosis is not None:
+        diagnosis = str(diagnosis).strip()[:100] or None
+    
+    # Reading ids are per shard, so the patient picks the shard
+    conn = get_db_connection(registration_id=registration_id)
+    if not conn:
+        return jsonify({'error': 'Database connection error'}), 500
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            UPDATE vital_signs SET diagnosis = %s, diagnosis_updated_at = NOW(6)
+            WHERE id = %s AND registration_id = %s
+        ''', (diagnosis, vital_id, registration_id))
+        if cursor.rowcount == 0:
+            return jsonify({'error': 'Reading not found'}), 404
+        conn.commit()
+        return jsonify({'id': vital_id, 'diagnosis': diagnosis})
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return jsonify({'error': f'Database error: {str(err)}'}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+@app.route('/metrics/analysis')
+def analysis_metrics():
+    return jsonify(analysis_executor.metrics())
+
+@app.route('/metrics/patient_cache')
+def patient_cache_metrics():
+    return jsonify(patient_cache.stats())
+
+@app.route('/export/vitals')
+def export_vitals():
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in export.EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format: {export_format}'}), 400
+    
+    try:
+        chunk_size = int(request.args.get('chunk_size', Config.EXPORT_CHUNK_SIZE))
+    except ValueError:
+        return jsonify({'error': 'chunk_size must be an integer'}), 400
+    if chunk_size < 1:
+        return jsonify({'error': 'chunk_size must be at least 1'}), 400
+    # Each shard producer and queued batch holds up to chunk_size rows
+    chunk_size = min(chunk_size, Config.EXPORT_MAX_CHUNK_SIZE)
+    decode_json = request.args.get('decode_json', '').lower() in ('1', 'true', 'yes')
+    filters = {
+        'start_date': request.args.get('start_date'),
+        'end_date': request.args.get('end_date'),
+        'registration_id': request.args.get('registration_id'),
+        'patient_from': request.args.get('patient_from'),
+        'patient_to': request.args.get('patient_to'),
+    }
+    
+    # Every shard is streamed in parallel (only the owning shard for a single patient)
+    rows = export.iter_sharded_rows(
+        chunk_size=chunk_size, decode_json=decode_json, pin_primary=primary_pinned(), **filters
+    )
+    
+    if export_format == 'parquet':
+        # Parquet needs a seekable file, so spool row groups to disk instead of memory
+        fd, path = tempfile.mkstemp(suffix='.parquet')
+        os.close(fd)
+        try:
+            export.write_parquet(rows, path, row_group_size=chunk_size, decode_json=decode_json)
+        except Exception as e:
+            os.remove(path)
+            return jsonify({'error': f'Export failed: {str(e)}'}), 500
+        response = send_file(path, mimetype='application/vnd.apache.parquet',
+                             as_attachment=True, download_name='vital_signs.parquet')
+        response.call_on_close(lambda: os.remove(path))
+        return response
+    
+    def generate():
+        try:
+            stream = export.stream_csv if export_format == 'csv' else export.stream_ndjson
+            for chunk in stream(rows, chunk_size=chunk_size):
+                yield chunk
+        finally:
+            rows.close()
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    extension = 'csv' if export_format == 'csv' else 'ndjson'
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=vital_signs.{extension}'}
+    )
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
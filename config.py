@@ -1,5 +1,66 @@
 class Config:
     MYSQL_HOST = 'localhost'
+    MYSQL_PORT = 3306
     MYSQL_USER = 'root'
     MYSQL_PASSWORD = 'root'
-    MYSQL_DB = 'patient_dashboard'
\ No newline at end of file
+    MYSQL_DB = 'patient_dashboard'
+
+    # Read replicas used for dashboard/history/export reads. Each entry is a dict
+    # with 'host' and optionally 'port', 'user', 'password' (defaults to the primary's), e.g.
+    # MYSQL_REPLICAS = [{'host': 'replica1.local'}, {'host': 'localhost', 'port': 3307}]
+    MYSQL_REPLICAS = []
+    # Seconds a session/patient keeps reading from the primary after a submission
+    READ_YOUR_WRITES_SECONDS = 5
+    # Seconds an unreachable replica is skipped before it is tried again
+    REPLICA_RETRY_SECONDS = 30
+    REPLICA_CONNECT_TIMEOUT = 2
+
+    # Hash sharding by registration_id. Leave empty to use the single database above.
+    # Each entry needs a unique 'name' and may set 'host', 'port', 'user', 'password',
+    # 'database' and 'replicas' (defaults come from the settings above), e.g.
+    # SHARDS = [{'name': 's1', 'database': 'vitals_s1'}, {'name': 's2', 'database': 'vitals_s2'}]
+    # A shard marked 'pending': True receives data from rebalance.py but no traffic yet.
+    SHARDS = []
+    SHARD_VIRTUAL_NODES = 128
+
+    # Bulk export: rows fetched per round trip and written per chunk/row group
+    EXPORT_CHUNK_SIZE = 5000
+    EXPORT_MAX_CHUNK_SIZE = 50000
+
+    # Doctor dashboard patients API paging
+    PATIENTS_PAGE_SIZE = 50
+    PATIENTS_MAX_PAGE_SIZE = 200
+
+    # Rows per committed batch when backfilling patient_snapshots
+    SNAPSHOT_BACKFILL_BATCH_SIZE = 1000
+
+    # Analysis worker pool for trend analysis and disease prediction
+    ANALYSIS_WORKERS = 2
+    # Tasks queued or running before submissions get a 503
+    ANALYSIS_MAX_PENDING = 8
+    # Seconds to wait for a worker before falling back to rules-only output
+    ANALYSIS_TIMEOUT = 2.0
+    ANALYSIS_RETRY_AFTER = 2
+    # Optional training data file loaded by each worker on startup
+    ANALYSIS_MODEL_DATA = None
+
+    # In-process patient cache: entries kept and seconds before a cached row is revalidated
+    PATIENT_CACHE_SIZE = 10000
+    PATIENT_CACHE_TTL = 30
+
+    # Request profiling: requests carrying PROFILE_ADMIN_TOKEN in the X-Profile-Token
+    # header, plus a random PROFILE_SAMPLE_RATE fraction, are profiled into PROFILE_DIR
+    PROFILE_ADMIN_TOKEN = None
+    PROFILE_SAMPLE_RATE = 0.0
+    PROFILE_DIR = 'profiles'
+    PROFILE_MAX_PROFILES = 200
+    # Seconds between stack samples for the collapsed-stack output
+    PROFILE_SAMPLE_INTERVAL = 0.005
+
+    # Model retraining (retrain.py): published versions live in MODEL_DIR
+    MODEL_DIR = 'models'
+    RETRAIN_CHUNK_SIZE = 10000
+    # Parallel tree building jobs; -1 uses every core
+    RETRAIN_N_JOBS = -1
+    # Macro F1 gain over the current model required to publish a new version
+    RETRAIN_MIN_IMPROVEMENT = 0.0
@@ -0,0 +1,22 @@
+# Sort keys for the patients API; each one is read in order from an index on patients
+# (directions match the index columns, so no filesort is needed)
+PATIENT_SORTS = {
+    'recent': 'p.last_vital_at DESC, p.registration_id DESC',
+    'name': 'p.name, p.registration_id',
+    'critical': 'p.last_status, p.last_vital_at DESC, p.registration_id DESC',
+}
+PATIENT_STATUSES = ('critical', 'warning', 'normal')
+# Python equivalents of PATIENT_SORTS as (key, reverse) for merging pages gathered
+# from several shards; last_status is an ENUM, so it sorts in PATIENT_STATUSES order
+PATIENT_SORT_KEYS = {
+    'recent': (lambda p: (p['last_vital_at'], p['registration_id']), True),
+    'name': (lambda p: (p['name'].lower(), p['registration_id']), False),
+    'critical': (lambda p: (-PATIENT_STATUSES.index(p['status']), p['last_vital_at'], p['registration_id']), True),
+}
+
+
+def merge_patient_pages(shard_rows, sort, page, page_size):
+    """Merge per-shard results, each holding that shard's first (page + 1) pages, into one page"""
+    key, reverse = PATIENT_SORT_KEYS[sort]
+    rows = sorted((row for rows in shard_rows for row in rows), key=key, reverse=reverse)
+    return rows[page * page_size:(page + 1) * page_size]
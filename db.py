@@ -0,0 +1,97 @@
+import itertools
+import threading
+import time
+
+import mysql.connector
+
+
+class DatabaseRouter:
+    """Route connections between a primary and optional read replicas.
+
+    Reads are spread round-robin over healthy replicas. A replica that fails
+    to connect is skipped for ``retry_after`` seconds, and when no replica is
+    usable reads fall back to the primary. Patients that were written recently
+    are pinned to the primary for ``pin_seconds`` so their history reflects
+    the latest submission even if the replicas are lagging.
+
+    Patient pins live in this process only; the writing session is pinned
+    across processes by the caller (the Flask session's ``primary_until``).
+    """
+
+    def __init__(self, primary, replicas=None, database=None, pin_seconds=0,
+                 retry_after=30, connect_timeout=None):
+        self.primary = primary
+        self.replicas = list(replicas or [])
+        self.database = database
+        self.pin_seconds = pin_seconds
+        self.retry_after = retry_after
+        self.connect_timeout = connect_timeout
+        self._lock = threading.Lock()
+        self._next_replica = itertools.count()
+        self._down_until = {}
+        self._pinned_until = {}
+
+    def _connect(self, settings, timeout=None):
+        params = {
+            'host': settings.get('host', self.primary.get('host')),
+            'port': settings.get('port', self.primary.get('port', 3306)),
+            'user': settings.get('user', self.primary.get('user')),
+            'password': settings.get('password', self.primary.get('password')),
+            'database': settings.get('database', self.database),
+        }
+        if timeout:
+            params['connection_timeout'] = timeout
+        return mysql.connector.connect(**params)
+
+    def connect_primary(self):
+        return self._connect(self.primary)
+
+    def mark_down(self, index):
+        with self._lock:
+            self._down_until[index] = time.monotonic() + self.retry_after
+
+    def healthy_replicas(self):
+        now = time.monotonic()
+        with self._lock:
+            return [i for i in range(len(self.replicas)) if self._down_until.get(i, 0) <= now]
+
+    def record_write(self, registration_id):
+        """Pin a patient's reads to the primary after a write"""
+        if not registration_id or self.pin_seconds <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._pinned_until[registration_id] = now + self.pin_seconds
+            # Drop expired pins so the map does not grow without bound
+            if len(self._pinned_until) > 10000:
+                self._pinned_until = {k: v for k, v in self._pinned_until.items() if v > now}
+
+    def is_pinned(self, registration_id):
+        if not registration_id:
+            return False
+        with self._lock:
+            return self._pinned_until.get(registration_id, 0) > time.monotonic()
+
+    def connect_read(self, registration_id=None, pin_primary=False):
+        """Open a connection for a read-only query"""
+        if not self.replicas:
+            return self.connect_primary()
+        if pin_primary or self.is_pinned(registration_id):
+            try:
+                return self.connect_primary()
+            except mysql.connector.Error as err:
+                # A slightly stale read beats failing while the primary is down
+                print(f"Primary unavailable for pinned read, using a replica: {err}")
+
+        healthy = self.healthy_replicas()
+        if healthy:
+            start = next(self._next_replica) % len(healthy)
+            for index in healthy[start:] + healthy[:start]:
+                try:
+                    return self._connect(self.replicas[index], timeout=self.connect_timeout)
+                except mysql.connector.Error as err:
+                    print(f"Replica {self.replicas[index].get('host')} unavailable, skipping: {err}")
+                    self.mark_down(index)
+
+        return self.connect_primary()
+
@@ -0,0 +1,349 @@
+import argparse
+import csv
+import io
+import json
+import queue
+import sys
+import threading
+from datetime import date, datetime, timedelta
+
+from config import Config
+from sharding import shards
+import snapshots
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+    pq = None
+
+EXPORT_FORMATS = ('csv', 'ndjson', 'parquet')
+
+# Columns that hold JSON documents; these are passed through as raw strings
+# unless the caller explicitly asks for them to be decoded.
+JSON_COLUMNS = ('alerts', 'recommendations', 'comorbidities', 'medications')
+
+# (SQL expression, output column) pairs for the vital_signs/patients/snapshots join
+EXPORT_COLUMNS = [
+    ('v.id', 'id'),
+    ('v.registration_id', 'registration_id'),
+    ('COALESCE(s.name, p.name)', 'name'),
+    ('COALESCE(s.gender, p.gender)', 'gender'),
+    ('COALESCE(s.age, p.age)', 'age'),
+    ('v.date', 'date'),
+    ('v.time', 'time'),
+    ('v.height', 'height'),
+    ('v.weight', 'weight'),
+    ('v.bmi', 'bmi'),
+    ('v.temp', 'temp'),
+    ('v.systolic_bp', 'systolic_bp'),
+    ('v.diastolic_bp', 'diastolic_bp'),
+    ('v.pulse', 'pulse'),
+    ('v.pain_scale', 'pain_scale'),
+    ('v.risk_score', 'risk_score'),
+    ('v.risk_level', 'risk_level'),
+    ('v.summary', 'summary'),
+    ('v.alerts', 'alerts'),
+    ('v.recommendations', 'recommendations'),
+    ('COALESCE(s.comorbidities, p.comorbidities)', 'comorbidities'),
+    ('COALESCE(s.medications, p.medications)', 'medications'),
+    ('v.created_at', 'created_at'),
+]
+
+# Row ids are only unique within a shard, so every row also carries its shard name
+EXPORT_FIELDNAMES = [name for _, name in EXPORT_COLUMNS] + ['shard']
+
+
+def build_export_query(start_date=None, end_date=None, patient_from=None, patient_to=None, registration_id=None,
+                       legacy=()):
+    """Build the export SELECT and its parameters for a date and/or patient range"""
+    conditions = []
+    params = []
+    if start_date:
+        conditions.append('v.date >= %s')
+        params.append(start_date)
+    if end_date:
+        conditions.append('v.date <= %s')
+        params.append(end_date)
+    if registration_id:
+        conditions.append('v.registration_id = %s')
+        params.append(registration_id)
+    if patient_from:
+        conditions.append('v.registration_id >= %s')
+        params.append(patient_from)
+    if patient_to:
+        conditions.append('v.registration_id <= %s')
+        params.append(patient_to)
+
+    # Demographics come from the snapshot taken at reading time; rows not yet
+    # backfilled use the legacy vital_signs columns (while they exist), then the patient
+    demographics = snapshots.demographic_expressions(legacy)
+    query = (
+        'SELECT {} FROM vital_signs v '
+        'JOIN patients p ON v.registration_id = p.registration_id '
+        'LEFT JOIN patient_snapshots s ON s.id = v.snapshot_id'
+    ).format(', '.join(f'{demographics.get(name, expr)} AS {name}' for expr, name in EXPORT_COLUMNS))
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    # Walk the primary key so the server can stream rows without sorting
+    query += ' ORDER BY v.id'
+    return query, params
+
+
+def _to_text(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8')
+    return value
+
+
+def _decode_json(value):
+    value = _to_text(value)
+    if value is None or value == '':
+        return []
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _serialize(value):
+    """Convert DB values into CSV/JSON friendly scalars"""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        # MySQL TIME columns come back as timedelta
+        total = int(value.total_seconds())
+        return f'{total // 3600:02d}:{(total % 3600) // 60:02d}:{total % 60:02d}'
+    return _to_text(value)
+
+
+def iter_vital_rows(conn, chunk_size=None, decode_json=False, **filters):
+    """Yield exported rows as dicts using an unbuffered cursor.
+
+    Rows are pulled from the server ``chunk_size`` at a time so memory stays
+    flat no matter how many rows match the filters.
+    """
+    chunk_size = chunk_size or Config.EXPORT_CHUNK_SIZE
+    cursor = conn.cursor()
+    try:
+        legacy = snapshots.legacy_columns_present(cursor)
+    finally:
+        cursor.close()
+    query, params = build_export_query(legacy=legacy, **filters)
+    cursor = conn.cursor(dictionary=True, buffered=False)
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                for column in JSON_COLUMNS:
+                    row[column] = _decode_json(row[column]) if decode_json else _to_text(row[column])
+                yield row
+    finally:
+        cursor.close()
+
+
+def iter_sharded_rows(chunk_size=None, decode_json=False, pin_primary=False, **filters):
+    """Stream export rows from every shard in parallel.
+
+    One producer thread per shard reads with its own unbuffered cursor and
+    hands chunks over a bounded queue, so memory stays flat however many
+    shards and rows there are. Rows from different shards are interleaved.
+    """
+    chunk_size = chunk_size or Config.EXPORT_CHUNK_SIZE
+    # A single-patient export only needs the shard that owns the patient
+    names = [shards.shard_for(filters['registration_id'])] if filters.get('registration_id') else shards.active
+    chunks = queue.Queue(maxsize=2 * len(names))
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # Give up if the consumer has gone away (e.g. the client disconnected)
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(name):
+        conn = None
+        try:
+            conn = shards.routers[name].connect_read(pin_primary=pin_primary)
+            batch = []
+            for row in iter_vital_rows(conn, chunk_size=chunk_size, decode_json=decode_json, **filters):
+                # Skip patients already copied to a new shard but not yet deleted here
+                if not shards.owns(name, row['registration_id']):
+                    continue
+                row['shard'] = name
+                batch.append(row)
+                if len(batch) >= chunk_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch:
+                put(batch)
+        except Exception as e:
+            put(e)
+        finally:
+            if conn is not None:
+                conn.close()
+            put(done)
+
+    producers = [threading.Thread(target=produce, args=(name,), daemon=True) for name in names]
+    for producer in producers:
+        producer.start()
+    try:
+        remaining = len(producers)
+        while remaining:
+            item = chunks.get()
+            if item is done:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield from item
+    finally:
+        stop.set()
+
+
+def stream_csv(rows, chunk_size=None):
+    """Yield CSV text in chunks of roughly ``chunk_size`` rows"""
+    chunk_size = chunk_size or Config.EXPORT_CHUNK_SIZE
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDNAMES, extrasaction='ignore')
+    writer.writeheader()
+    pending = 0
+    for row in rows:
+        writer.writerow({
+            key: json.dumps(value) if isinstance(value, (list, dict)) else _serialize(value)
+            for key, value in row.items()
+        })
+        pending += 1
+        if pending >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_ndjson(rows, chunk_size=None):
+    """Yield newline-delimited JSON in chunks of roughly ``chunk_size`` rows"""
+    chunk_size = chunk_size or Config.EXPORT_CHUNK_SIZE
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({key: _serialize(value) for key, value in row.items()}))
+        if len(lines) >= chunk_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _parquet_schema(decode_json):
+    if pa is None:
+        raise RuntimeError('Parquet export requires pyarrow (pip install pyarrow)')
+    json_type = pa.list_(pa.string()) if decode_json else pa.string()
+    types = {
+        'id': pa.int64(),
+        'age': pa.int32(),
+        'date': pa.date32(),
+        'height': pa.float64(),
+        'weight': pa.float64(),
+        'bmi': pa.float64(),
+        'temp': pa.float64(),
+        'systolic_bp': pa.int32(),
+        'diastolic_bp': pa.int32(),
+        'pulse': pa.int32(),
+        'pain_scale': pa.int32(),
+        'risk_score': pa.float64(),
+        'created_at': pa.timestamp('s'),
+    }
+    for column in JSON_COLUMNS:
+        types[column] = json_type
+    return pa.schema([(name, types.get(name, pa.string())) for name in EXPORT_FIELDNAMES])
+
+
+def write_parquet(rows, path, row_group_size=None, decode_json=False):
+    """Write rows to a Parquet file, flushing one row group per chunk"""
+    row_group_size = row_group_size or Config.EXPORT_CHUNK_SIZE
+    schema = _parquet_schema(decode_json)
+    total = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = []
+        for row in rows:
+            row['time'] = _serialize(row['time'])
+            if decode_json:
+                for column in JSON_COLUMNS:
+                    row[column] = [
+                        item if isinstance(item, str) else json.dumps(item)
+                        for item in (row[column] if isinstance(row[column], list) else [row[column]])
+                    ]
+            batch.append(row)
+            if len(batch) >= row_group_size:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                total += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            total += len(batch)
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stream vital signs joined with patients to CSV, NDJSON or Parquet.')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--output', '-o', help='Output file (defaults to stdout; required for parquet)')
+    parser.add_argument('--start-date', help='First reading date to include (YYYY-MM-DD)')
+    parser.add_argument('--end-date', help='Last reading date to include (YYYY-MM-DD)')
+    parser.add_argument('--registration-id', help='Export a single patient')
+    parser.add_argument('--patient-from', help='Lowest registration_id to include')
+    parser.add_argument('--patient-to', help='Highest registration_id to include')
+    parser.add_argument('--chunk-size', type=int, default=Config.EXPORT_CHUNK_SIZE,
+                        help='Rows fetched per round trip and per output chunk/row group')
+    parser.add_argument('--decode-json', action='store_true',
+                        help='Decode alerts/recommendations/comorbidities/medications instead of passing raw JSON text')
+    args = parser.parse_args(argv)
+
+    if args.format == 'parquet' and not args.output:
+        parser.error('--output is required for parquet exports')
+    if args.chunk_size < 1:
+        parser.error('--chunk-size must be at least 1')
+    args.chunk_size = min(args.chunk_size, Config.EXPORT_MAX_CHUNK_SIZE)
+
+    filters = {
+        'start_date': args.start_date,
+        'end_date': args.end_date,
+        'registration_id': args.registration_id,
+        'patient_from': args.patient_from,
+        'patient_to': args.patient_to,
+    }
+
+    # Exports are read-only, so each shard is read from a replica when one exists
+    rows = iter_sharded_rows(chunk_size=args.chunk_size, decode_json=args.decode_json, **filters)
+    if args.format == 'parquet':
+        total = write_parquet(rows, args.output, row_group_size=args.chunk_size, decode_json=args.decode_json)
+        print(f"Exported {total} rows to {args.output}", file=sys.stderr)
+        return 0
+
+    stream = stream_csv if args.format == 'csv' else stream_ndjson
+    out = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for chunk in stream(rows, chunk_size=args.chunk_size):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,22 +1,30 @@
+import argparse
+import sys
+
 import mysql.connector
 from config import Config
+from sharding import shard_configs
 
-def init_database():
+def init_database(shard):
+    """Create one shard's database if needed and recreate its tables"""
+    database = shard.get('database', Config.MYSQL_DB)
     try:
-        # Connect to MySQL server
+        # Connect to the shard's MySQL server
         conn = mysql.connector.connect(
-            host=Config.MYSQL_HOST,
-            user=Config.MYSQL_USER,
-            password=Config.MYSQL_PASSWORD
+            host=shard.get('host', Config.MYSQL_HOST),
+            port=shard.get('port', Config.MYSQL_PORT),
+            user=shard.get('user', Config.MYSQL_USER),
+            password=shard.get('password', Config.MYSQL_PASSWORD)
         )
         cursor = conn.cursor()
         
         # Create database if it doesn't exist
-        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {Config.MYSQL_DB}")
-        cursor.execute(f"USE {Config.MYSQL_DB}")
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {database}")
+        cursor.execute(f"USE {database}")
         
         # Drop existing tables if they exist
         cursor.execute("DROP TABLE IF EXISTS vital_signs")
+        cursor.execute("DROP TABLE IF EXISTS patient_snapshots")
         cursor.execute("DROP TABLE IF EXISTS patients")
         
         # Create vital_signs table with proper JSON columns
@@ -24,9 +32,7 @@ def init_database():
             CREATE TABLE vital_signs (
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 registration_id VARCHAR(50) NOT NULL,
-                name VARCHAR(100) NOT NULL,
-                gender ENUM('MALE', 'FEMALE') NOT NULL,
-                age INT NOT NULL,
+                snapshot_id INT NULL,
                 date DATE NOT NULL,
                 time TIME NOT NULL,
                 height FLOAT NOT NULL,
@@ -42,9 +48,28 @@ def init_database():
                 recommendations JSON NOT NULL,
                 risk_score FLOAT,
                 risk_level ENUM('LOW', 'MODERATE', 'HIGH', 'CRITICAL'),
+                diagnosis VARCHAR(100) NULL,
+                diagnosis_updated_at TIMESTAMP(6) NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_vital_signs_date (date),
+                INDEX idx_vital_signs_registration (registration_id, id),
+                INDEX idx_vital_signs_diagnosis_updated (diagnosis_updated_at)
+            )
+        ''')
+        
+        # Create patient_snapshots table for point-in-time demographics
+        cursor.execute('''
+            CREATE TABLE patient_snapshots (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                registration_id VARCHAR(50) NOT NULL,
+                name VARCHAR(100) NOT NULL,
+                gender ENUM('MALE', 'FEMALE') NOT NULL,
+                age INT NOT NULL,
                 comorbidities JSON,
                 medications JSON,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                fingerprint CHAR(64) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_patient_snapshots_fingerprint (registration_id, fingerprint)
             )
         ''')
         
@@ -59,22 +84,44 @@ def init_database():
                 medications JSON,
                 last_risk_score FLOAT,
                 last_risk_level ENUM('LOW', 'MODERATE', 'HIGH', 'CRITICAL'),
+                last_vital_id INT NULL,
+                last_vital_at TIMESTAMP NULL,
+                last_status ENUM('critical', 'warning', 'normal'),
+                snapshot_id INT NULL,
+                version INT NOT NULL DEFAULT 1,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                INDEX idx_patients_recent (last_vital_at, registration_id),
+                INDEX idx_patients_name (name, registration_id),
+                INDEX idx_patients_status_recent (last_status, last_vital_at DESC, registration_id DESC)
             )
         ''')
         
         conn.commit()
-        print(f"Database '{Config.MYSQL_DB}' created or already exists")
+        print(f"Shard {shard['name']}: database '{database}' created or already exists")
         print("Tables created successfully")
+        return True
         
     except mysql.connector.Error as err:
-        print(f"Error: {err}")
+        print(f"Error on shard {shard['name']}: {err}")
+        return False
     finally:
         if 'cursor' in locals():
             cursor.close()
         if 'conn' in locals():
             conn.close()
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create every shard database and (re)create its tables; existing tables are dropped.')
+    parser.add_argument('--shard', action='append', dest='names', metavar='NAME',
+                        help='Only initialize this shard (repeatable), e.g. a newly added one')
+    args = parser.parse_args(argv)
+    
+    configs = [shard for shard in shard_configs() if not args.names or shard['name'] in args.names]
+    if args.names and len(configs) != len(set(args.names)):
+        parser.error(f"Unknown shard; configured shards: {', '.join(shard['name'] for shard in shard_configs())}")
+    ok = [init_database(shard) for shard in configs]
+    return 0 if all(ok) else 1
+
 if __name__ == "__main__":
-    init_database() 
\ No newline at end of file
+    sys.exit(main()) 
\ No newline at end of file
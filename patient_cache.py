@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+
+PATIENT_QUERY = '''
+    SELECT p.*, s.fingerprint AS snapshot_fingerprint
+    FROM patients p
+    LEFT JOIN patient_snapshots s ON s.id = p.snapshot_id
+    WHERE p.registration_id = %s
+'''
+
+
+def fetch_patient(cursor, registration_id):
+    """Load a patient row without going through any cache"""
+    cursor.execute(PATIENT_QUERY, (registration_id,))
+    return cursor.fetchone()
+
+
+class PatientCache:
+    """Bounded LRU cache of patient rows keyed by registration_id.
+
+    Entries younger than ``ttl`` seconds are served without touching the
+    database. Older entries are revalidated with a primary-key lookup of the
+    ``version`` column, which every demographic change increments, and of the
+    latest reading id, so a change made by another worker is picked up within
+    ``ttl`` seconds. Writers that rely on a cached row guard their UPDATE with
+    the cached version.
+
+    Rows read from a replica (``read``) are cached as unverified: readers may
+    use them within ``ttl``, but ``lookup``, which must be given a cursor on
+    the primary, revalidates them before a writer relies on them.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'revalidations': 0, 'invalidations': 0, 'evictions': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, registration_id):
+        """Return (row, checked_at, verified) for a cached patient, or (None, None, False)"""
+        with self._lock:
+            entry = self._entries.get(registration_id)
+            if entry is None:
+                return None, None, False
+            self._entries.move_to_end(registration_id)
+            return dict(entry[0]), entry[1], entry[2]
+
+    def put(self, row, verified=True):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[row['registration_id']] = (dict(row), time.monotonic(), verified)
+            self._entries.move_to_end(row['registration_id'])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def update(self, registration_id, **fields):
+        """Apply a write that did not change the version to a cached row"""
+        with self._lock:
+            entry = self._entries.get(registration_id)
+            if entry is not None:
+                entry[0].update(fields)
+
+    def invalidate(self, registration_id):
+        with self._lock:
+            if self._entries.pop(registration_id, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def _touch(self, registration_id):
+        with self._lock:
+            entry = self._entries.get(registration_id)
+            if entry is not None:
+                self._entries[registration_id] = (entry[0], time.monotonic(), True)
+
+    def _fresh(self, checked_at):
+        return time.monotonic() - checked_at < self.ttl
+
+    def lookup(self, cursor, registration_id):
+        """Read-through lookup of a patient row on the primary, or None if the patient does not exist"""
+        row, checked_at, verified = self.get(registration_id)
+        if row is not None:
+            if verified and self._fresh(checked_at):
+                self._count('hits')
+                return row
+            # Risk-only updates keep the version, so the latest reading is compared as well
+            cursor.execute('SELECT version, last_vital_id FROM patients WHERE registration_id = %s',
+                           (registration_id,))
+            current = cursor.fetchone()
+            if current and (current['version'], current['last_vital_id']) == (row['version'], row['last_vital_id']):
+                self._count('revalidations')
+                self._touch(registration_id)
+                return row
+            self.invalidate(registration_id)
+
+        self._count('misses')
+        row = fetch_patient(cursor, registration_id)
+        if row:
+            self.put(row)
+            return dict(row)
+        return None
+
+    def read(self, cursor, registration_id, bypass=False):
+        """Read-through lookup for readers on any connection, replicas included.
+
+        ``bypass`` skips a cached row (e.g. while the request is pinned to the
+        primary for read-your-writes). Rows loaded here are cached unverified.
+        """
+        if not bypass:
+            row, checked_at, _ = self.get(registration_id)
+            if row is not None and self._fresh(checked_at):
+                self._count('hits')
+                return row
+
+        self._count('misses')
+        row = fetch_patient(cursor, registration_id)
+        if row:
+            self.put(row, verified=False)
+            return dict(row)
+        return None
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['revalidations'] + self._stats['misses']
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                **self._stats,
+                'hit_ratio': round((lookups - self._stats['misses']) / lookups, 4) if lookups else 0.0,
+            }
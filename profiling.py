@@ -0,0 +1,205 @@
+import argparse
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+
+from config import Config
+
+PROFILE_HEADER = 'X-Profile-Token'
+
+
+class _StackSampler(threading.Thread):
+    """Periodically sample one thread's stack and count collapsed stacks"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfiler:
+    """Opt-in per-request profiling for Flask.
+
+    A request is profiled when it carries the admin token in the
+    ``X-Profile-Token`` header or is picked by ``sample_rate``. Each profile is
+    saved as pstats (cProfile), a collapsed-stack file that flamegraph.pl or
+    speedscope can load, and a small JSON metadata file. Only the newest
+    ``max_profiles`` profiles are kept. With no token and a zero sample rate
+    no hooks are installed at all.
+
+    Profiles are saved on request teardown, so a view that raises still stops
+    the profiler. Streamed responses are covered until the body is fully sent
+    only when the generator is wrapped in ``stream_with_context``; otherwise
+    the profile ends when the view returns.
+    """
+
+    def __init__(self, directory, max_profiles=200, sample_rate=0.0, admin_token=None, sample_interval=0.005):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.sample_rate = sample_rate
+        self.admin_token = admin_token
+        self.sample_interval = sample_interval
+        self._prune_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.admin_token) or self.sample_rate > 0
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._start)
+        app.after_request(self._record_status)
+        app.teardown_request(self._finish)
+
+    def _should_profile(self):
+        token = request.headers.get(PROFILE_HEADER)
+        if token and self.admin_token and hmac.compare_digest(token.encode(), self.admin_token.encode()):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _start(self):
+        if not self._should_profile():
+            return
+        profiler = cProfile.Profile()
+        sampler = _StackSampler(threading.get_ident(), self.sample_interval)
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return
+        sampler.start()
+        g._profile = (profiler, sampler, time.perf_counter(), datetime.now())
+
+    def _record_status(self, response):
+        if '_profile' in g:
+            g._profile_status = response.status_code
+        return response
+
+    def _finish(self, exc=None):
+        state = g.pop('_profile', None)
+        if state is None:
+            return
+        profiler, sampler, started, started_at = state
+        profiler.disable()
+        sampler.stop()
+        duration_ms = (time.perf_counter() - started) * 1000
+        status_code = g.pop('_profile_status', 500 if exc is not None else None)
+        try:
+            self._save(profiler, sampler.stacks, duration_ms, started_at, status_code)
+        except Exception as e:
+            print(f"Error saving request profile: {e}")
+
+    def _save(self, profiler, stacks, duration_ms, started_at, status_code):
+        route = request.url_rule.rule if request.url_rule else request.path
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+        profile_id = f"{started_at.strftime('%Y%m%dT%H%M%S%f')}_{request.method}_{slug}"
+        base = os.path.join(self.directory, profile_id)
+
+        profiler.dump_stats(base + '.pstats')
+        with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump({
+                'id': profile_id,
+                'method': request.method,
+                'route': route,
+                'path': request.path,
+                'status': status_code,
+                'duration_ms': round(duration_ms, 2),
+                'started_at': started_at.isoformat(),
+                'samples': sum(stacks.values()),
+            }, f)
+        self._prune()
+
+    def _prune(self):
+        with self._prune_lock:
+            profiles = sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith('.json'))
+            for profile_id in profiles[:max(len(profiles) - self.max_profiles, 0)]:
+                for ext in ('.json', '.pstats', '.collapsed'):
+                    try:
+                        os.remove(os.path.join(self.directory, profile_id + ext))
+                    except FileNotFoundError:
+                        pass
+
+
+def load_profiles(directory):
+    profiles = []
+    if not os.path.isdir(directory):
+        return profiles
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect captured request profiles.')
+    parser.add_argument('--dir', default=Config.PROFILE_DIR, help='Profile directory')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = subparsers.add_parser('list', help='List the slowest captured requests')
+    list_parser.add_argument('--top', type=int, default=20)
+    list_parser.add_argument('--route', help='Only show profiles whose route contains this text')
+
+    show_parser = subparsers.add_parser('show', help='Print the top functions of one profile')
+    show_parser.add_argument('profile_id')
+    show_parser.add_argument('--sort', default='cumulative', help='pstats sort key')
+    show_parser.add_argument('--limit', type=int, default=30)
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        profiles = load_profiles(args.dir)
+        if args.route:
+            profiles = [p for p in profiles if args.route in p['route']]
+        profiles.sort(key=lambda p: p['duration_ms'], reverse=True)
+        for p in profiles[:args.top]:
+            print(f"{p['duration_ms']:>10.1f} ms  {p['status']}  {p['method']:<6} {p['path']:<40} {p['id']}")
+        return 0
+
+    path = os.path.join(args.dir, args.profile_id + '.pstats')
+    if not os.path.exists(path):
+        print(f"No such profile: {args.profile_id}", file=sys.stderr)
+        return 1
+    pstats.Stats(path).sort_stats(args.sort).print_stats(args.limit)
+    print(f"Flame graph input: {os.path.join(args.dir, args.profile_id + '.collapsed')}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
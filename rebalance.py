@@ -0,0 +1,318 @@
+import argparse
+import sys
+from collections import Counter
+
+from config import Config
+from sharding import ShardManager, shard_configs
+import snapshots
+
+# Reading-specific vital_signs columns; ids are reassigned on the target shard
+VITAL_COPY_COLUMNS = (
+    'registration_id', 'date', 'time', 'height', 'weight', 'bmi', 'temp',
+    'systolic_bp', 'diastolic_bp', 'pulse', 'pain_scale', 'summary', 'alerts',
+    'recommendations', 'risk_score', 'risk_level', 'diagnosis', 'diagnosis_updated_at', 'created_at',
+)
+
+PATIENT_COPY_COLUMNS = (
+    'registration_id', 'name', 'gender', 'age', 'comorbidities', 'medications',
+    'last_risk_score', 'last_risk_level', 'last_vital_at', 'last_status',
+    'version', 'created_at', 'updated_at',
+)
+
+
+def ensure_moves_table(cursor):
+    """Bookkeeping for patients copied to this shard but not yet removed from the source"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shard_moves (
+            registration_id VARCHAR(50) PRIMARY KEY,
+            source_shard VARCHAR(50) NOT NULL,
+            max_source_vital_id INT NOT NULL,
+            target_version INT NOT NULL,
+            target_last_vital_id INT NULL,
+            copied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _target_snapshot(src, dst, registration_id, source_snapshot_id, mapping):
+    """Id on the target of the snapshot with the same fingerprint, copying it if needed"""
+    if source_snapshot_id is None:
+        return None
+    if source_snapshot_id in mapping:
+        return mapping[source_snapshot_id]
+    src.execute('SELECT * FROM patient_snapshots WHERE id = %s', (source_snapshot_id,))
+    snapshot = src.fetchone()
+    if not snapshot:
+        return None
+    dst.execute('''
+        SELECT id FROM patient_snapshots
+        WHERE registration_id = %s AND fingerprint = %s
+        ORDER BY id LIMIT 1
+    ''', (registration_id, snapshot['fingerprint']))
+    existing = dst.fetchone()
+    if existing:
+        mapping[source_snapshot_id] = existing['id']
+    else:
+        mapping[source_snapshot_id], _ = snapshots.ensure_snapshot(
+            dst, registration_id, snapshot['name'], snapshot['gender'], snapshot['age'],
+            snapshot['comorbidities'], snapshot['medications'],
+            current_fingerprint='', created_at=snapshot['created_at']
+        )
+    return mapping[source_snapshot_id]
+
+
+def _copy_vitals(src, dst, registration_id, after_id, snapshot_map, batch_size):
+    """Copy a patient's readings with id > after_id; returns ({source id: target id}, max source id)"""
+    vital_map = {}
+    max_id = after_id
+    columns = ', '.join(VITAL_COPY_COLUMNS + ('snapshot_id',))
+    placeholders = ', '.join(['%s'] * (len(VITAL_COPY_COLUMNS) + 1))
+    while True:
+        src.execute(f'''
+            SELECT id, snapshot_id, {', '.join(VITAL_COPY_COLUMNS)}
+            FROM vital_signs
+            WHERE registration_id = %s AND id > %s
+            ORDER BY id
+            LIMIT %s
+        ''', (registration_id, max_id, batch_size))
+        rows = src.fetchall()
+        if not rows:
+            break
+        for row in rows:
+            snapshot_id = _target_snapshot(src, dst, registration_id, row['snapshot_id'], snapshot_map)
+            dst.execute(
+                f'INSERT INTO vital_signs ({columns}) VALUES ({placeholders})',
+                tuple(row[column] for column in VITAL_COPY_COLUMNS) + (snapshot_id,)
+            )
+            vital_map[row['id']] = dst.lastrowid
+        max_id = rows[-1]['id']
+    return vital_map, max_id
+
+
+def _write_patient(src, dst, registration_id, vital_map, snapshot_map, update=False):
+    src.execute('SELECT * FROM patients WHERE registration_id = %s', (registration_id,))
+    patient = src.fetchone()
+    if not patient:
+        return None
+    values = [patient[column] for column in PATIENT_COPY_COLUMNS]
+    values.append(_target_snapshot(src, dst, registration_id, patient['snapshot_id'], snapshot_map))
+    values.append(vital_map.get(patient['last_vital_id']))
+    columns = PATIENT_COPY_COLUMNS + ('snapshot_id', 'last_vital_id')
+    if update:
+        assignments = ', '.join(f'{column} = %s' for column in columns[1:])
+        dst.execute(f'UPDATE patients SET {assignments} WHERE registration_id = %s',
+                    values[1:] + [registration_id])
+    else:
+        dst.execute(
+            f"INSERT INTO patients ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+            values
+        )
+    return patient
+
+
+def _delete_patient(cursor, registration_id):
+    for table in ('vital_signs', 'patient_snapshots', 'patients'):
+        cursor.execute(f'DELETE FROM {table} WHERE registration_id = %s', (registration_id,))
+
+
+def _iter_registration_ids(conn, batch_size):
+    cursor = conn.cursor()
+    last = ''
+    try:
+        while True:
+            cursor.execute('''
+                SELECT registration_id FROM patients
+                WHERE registration_id > %s
+                ORDER BY registration_id
+                LIMIT %s
+            ''', (last, batch_size))
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                break
+            yield from ids
+            last = ids[-1]
+    finally:
+        cursor.close()
+
+
+def copy_moved_patients(current, future, batch_size, dry_run=False):
+    """Copy every patient whose owner changes under the future ring onto its new shard"""
+    planned = Counter()
+    for source in current.active:
+        src_conn = current.routers[source].connect_primary()
+        targets = {}
+        try:
+            for registration_id in list(_iter_registration_ids(src_conn, batch_size)):
+                target = future.shard_for(registration_id)
+                if target == source:
+                    continue
+                planned[(source, target)] += 1
+                if dry_run:
+                    continue
+                if target not in targets:
+                    targets[target] = future.routers[target].connect_primary()
+                    cursor = targets[target].cursor()
+                    ensure_moves_table(cursor)
+                    cursor.close()
+                _copy_patient(src_conn, targets[target], source, registration_id, batch_size)
+        finally:
+            for conn in targets.values():
+                conn.close()
+            src_conn.close()
+    for (source, target), count in sorted(planned.items()):
+        print(f"{'Would move' if dry_run else 'Copied'} {count} patients from {source} to {target}")
+    return planned
+
+
+def _copy_patient(src_conn, dst_conn, source, registration_id, batch_size):
+    src = src_conn.cursor(dictionary=True)
+    dst = dst_conn.cursor(dictionary=True)
+    try:
+        # Re-running a copy starts from scratch for this patient
+        _delete_patient(dst, registration_id)
+        dst.execute('DELETE FROM shard_moves WHERE registration_id = %s', (registration_id,))
+        snapshot_map = {}
+        vital_map, max_id = _copy_vitals(src, dst, registration_id, 0, snapshot_map, batch_size)
+        patient = _write_patient(src, dst, registration_id, vital_map, snapshot_map)
+        dst.execute('''
+            INSERT INTO shard_moves (registration_id, source_shard, max_source_vital_id, target_version, target_last_vital_id)
+            VALUES (%s, %s, %s, %s, %s)
+        ''', (registration_id, source, max_id, patient['version'], vital_map.get(patient['last_vital_id'])))
+        dst_conn.commit()
+    except Exception:
+        dst_conn.rollback()
+        raise
+    finally:
+        src.close()
+        dst.close()
+
+
+def _primary(manager, name, conns):
+    if name not in conns:
+        conns[name] = manager.routers[name].connect_primary()
+    return conns[name]
+
+
+def _finish_move(src_conn, dst_conn, move, batch_size):
+    """Copy readings the source took after `copy`, then delete the patient from the source"""
+    registration_id = move['registration_id']
+    src = src_conn.cursor(dictionary=True)
+    dst = dst_conn.cursor(dictionary=True)
+    try:
+        # Readings submitted to the source between the copy and the switch-over
+        snapshot_map = {}
+        vital_map, _ = _copy_vitals(
+            src, dst, registration_id, move['max_source_vital_id'], snapshot_map, batch_size
+        )
+        dst.execute('SELECT version, last_vital_id FROM patients WHERE registration_id = %s',
+                    (registration_id,))
+        current = dst.fetchone()
+        untouched = current and (current['version'], current['last_vital_id']) == (
+            move['target_version'], move['target_last_vital_id']
+        )
+        if vital_map and untouched:
+            # No writes reached the target yet, so the source row is the newest
+            _write_patient(src, dst, registration_id, vital_map, snapshot_map, update=True)
+        dst.execute('DELETE FROM shard_moves WHERE registration_id = %s', (registration_id,))
+        dst_conn.commit()
+        _delete_patient(src, registration_id)
+        src_conn.commit()
+    except Exception:
+        dst_conn.rollback()
+        src_conn.rollback()
+        raise
+    finally:
+        src.close()
+        dst.close()
+
+
+def _move_stray(src_conn, dst_conn, registration_id, batch_size):
+    """Move a patient the source took on after `copy`, merging with any rows the target has since"""
+    src = src_conn.cursor(dictionary=True)
+    dst = dst_conn.cursor(dictionary=True)
+    try:
+        snapshot_map = {}
+        vital_map, _ = _copy_vitals(src, dst, registration_id, 0, snapshot_map, batch_size)
+        dst.execute('SELECT 1 FROM patients WHERE registration_id = %s', (registration_id,))
+        if not dst.fetchone():
+            _write_patient(src, dst, registration_id, vital_map, snapshot_map)
+        # Otherwise the target's row was written after the switch-over and is the newest
+        dst_conn.commit()
+        _delete_patient(src, registration_id)
+        src_conn.commit()
+    except Exception:
+        dst_conn.rollback()
+        src_conn.rollback()
+        raise
+    finally:
+        src.close()
+        dst.close()
+
+
+def finish_moves(live, batch_size):
+    """After the new shard is live: move whatever reached the sources since `copy`, then delete the source copies"""
+    finished = Counter()
+    conns = {}
+    try:
+        for target in live.names:
+            dst = _primary(live, target, conns).cursor(dictionary=True)
+            try:
+                ensure_moves_table(dst)
+                dst.execute('SELECT * FROM shard_moves')
+                moves = dst.fetchall()
+            finally:
+                dst.close()
+            for move in moves:
+                source = move['source_shard']
+                _finish_move(_primary(live, source, conns), conns[target], move, batch_size)
+                finished[(source, target)] += 1
+
+        # Patients first registered on a source after `copy` ran have no shard_moves
+        # row; any patient a source no longer owns under the live ring is moved now
+        for source in live.active:
+            src_conn = _primary(live, source, conns)
+            for registration_id in list(_iter_registration_ids(src_conn, batch_size)):
+                target = live.shard_for(registration_id)
+                if target != source:
+                    _move_stray(src_conn, _primary(live, target, conns), registration_id, batch_size)
+                    finished[(source, target)] += 1
+    finally:
+        for conn in conns.values():
+            conn.close()
+    for (source, target), count in sorted(finished.items()):
+        print(f"Finished moving {count} patients from {source} to {target}")
+    return finished
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Move patients onto a newly added shard.',
+        epilog='1) add the shard to Config.SHARDS with "pending": True and run "python init_db.py --shard <name>"; '
+               '2) run "copy"; 3) remove "pending" and restart the app; 4) run "finish".'
+    )
+    parser.add_argument('command', choices=('copy', 'finish'))
+    parser.add_argument('--batch-size', type=int, default=Config.SNAPSHOT_BACKFILL_BATCH_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help='Only report how many patients would move')
+    args = parser.parse_args(argv)
+
+    configs = shard_configs()
+    # The ring the app uses now, and the ring once every pending shard is live
+    current = ShardManager(configs, vnodes=Config.SHARD_VIRTUAL_NODES)
+    future = ShardManager(configs, vnodes=Config.SHARD_VIRTUAL_NODES, include_pending=True)
+
+    if args.command == 'copy':
+        if current.active == future.active:
+            print('No pending shards configured; mark the new shard with "pending": True first')
+            return 1
+        copy_moved_patients(current, future, args.batch_size, dry_run=args.dry_run)
+    else:
+        if current.active != future.active:
+            # The app still routes these patients to the source shard
+            print('Shards are still marked pending; remove "pending" and restart the app before finishing')
+            return 1
+        finish_moves(future, args.batch_size)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,329 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.preprocessing import LabelEncoder
+
+from ai_module import AIModule
+from config import Config
+from sharding import shards
+import snapshots
+
+CURRENT_POINTER = 'current.json'
+RUNS_LOG = 'runs.jsonl'
+
+# Readings in (registration_id, id) order so per-patient trends can be computed chunk by chunk
+TRAINING_QUERY = '''
+    SELECT v.id, v.registration_id, v.date, v.bmi, v.temp, v.systolic_bp, v.diastolic_bp, v.pulse,
+           {age} AS age,
+           {comorbidities} AS comorbidities,
+           {medications} AS medications,
+           v.diagnosis
+    FROM vital_signs v
+    JOIN patients p ON p.registration_id = v.registration_id
+    LEFT JOIN patient_snapshots s ON s.id = v.snapshot_id
+    ORDER BY v.registration_id, v.id
+'''
+
+# Per-shard label change check. Only labelled readings are training rows and new
+# readings never change the trend features of earlier ones, so unlabelled
+# submissions do not count. Every label write sets diagnosis_updated_at, so only
+# those rows are read (via its index); the count catches labelled rows that were
+# deleted, e.g. moved off the shard by rebalance.py
+WATERMARK_QUERY = '''
+    SELECT MAX(diagnosis_updated_at), COUNT(diagnosis) FROM vital_signs
+    WHERE diagnosis_updated_at IS NOT NULL
+'''
+
+# Rows of the previous chunk's last patient carried over for the rolling window
+TREND_WINDOW = 3
+
+# Share of patients held out for scoring both the candidate and the current model
+HOLDOUT_PERCENT = 20
+
+
+def in_holdout(registration_id):
+    """Fixed per-patient split, so all of a patient's readings are on the same side"""
+    return int(hashlib.md5(str(registration_id).encode('utf-8')).hexdigest()[:8], 16) % 100 < HOLDOUT_PERCENT
+
+
+def current_model_path(model_dir):
+    """Path of the published model, or None if nothing has been published"""
+    pointer = os.path.join(model_dir, CURRENT_POINTER)
+    try:
+        with open(pointer, encoding='utf-8') as f:
+            return os.path.join(model_dir, json.load(f)['path'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _read_current(model_dir):
+    try:
+        with open(os.path.join(model_dir, CURRENT_POINTER), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def read_watermark(conn):
+    """[last label change, labelled readings] of a shard; changes whenever labels do"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(WATERMARK_QUERY)
+        labelled_at, labelled = cursor.fetchone()
+    finally:
+        cursor.close()
+    return [labelled_at.isoformat() if labelled_at else None, int(labelled or 0)]
+
+
+def load_training_data(conn, chunk_size, shard=None):
+    """Stream readings from vital_signs and return (features frame, labels, hold-out mask).
+
+    Only the engineered feature columns of labelled rows are kept in memory;
+    raw rows are dropped chunk by chunk. With ``shard``, patients that shard
+    does not own (copies left by an unfinished rebalance) are skipped.
+    """
+    cursor = conn.cursor()
+    try:
+        # Rows not yet backfilled into snapshots still carry demographics on vital_signs
+        legacy = snapshots.legacy_columns_present(cursor)
+    finally:
+        cursor.close()
+    cursor = conn.cursor(dictionary=True, buffered=False)
+    feature_frames = []
+    label_chunks = []
+    holdout_chunks = []
+    features = None
+    carry = None
+    try:
+        cursor.execute(TRAINING_QUERY.format(**snapshots.demographic_expressions(legacy)))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunk = pd.DataFrame(rows)
+            if shard is not None:
+                owned = {reg: shards.owns(shard, reg) for reg in chunk['registration_id'].unique()}
+                chunk = chunk[chunk['registration_id'].map(owned)].reset_index(drop=True)
+                if chunk.empty:
+                    continue
+            for column in ('comorbidities', 'medications'):
+                chunk[column] = chunk[column].apply(lambda x: x.decode('utf-8') if isinstance(x, (bytes, bytearray)) else x)
+            chunk['_carried'] = False
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+
+            # Keep the tail of the last patient in this chunk for the next one
+            last_patient = chunk['registration_id'].iloc[-1]
+            tail = chunk[chunk['registration_id'] == last_patient].tail(TREND_WINDOW - 1)
+            carry = tail.assign(_carried=True)
+
+            chunk_features = AIModule.build_features(chunk)
+            features = chunk_features
+            labelled = chunk[(~chunk['_carried']) & chunk['diagnosis'].notna()]
+            if len(labelled):
+                feature_frames.append(labelled[chunk_features].astype('float32').fillna(0))
+                label_chunks.append(labelled['diagnosis'].astype(str).to_numpy())
+                holdout_chunks.append(labelled['registration_id'].map(in_holdout).to_numpy(dtype=bool))
+    finally:
+        cursor.close()
+
+    if not feature_frames:
+        return None, None, None
+    return (pd.concat(feature_frames, ignore_index=True)[features], np.concatenate(label_chunks),
+            np.concatenate(holdout_chunks))
+
+
+def _score(y_true, y_pred):
+    return {
+        'accuracy': round(float(accuracy_score(y_true, y_pred)), 4),
+        'f1_macro': round(float(f1_score(y_true, y_pred, average='macro', zero_division=0)), 4),
+    }
+
+
+def evaluate_current(model_dir, X_test, y_test):
+    """Score the published model on the hold-out set, or None if there is none"""
+    path = current_model_path(model_dir)
+    if not path or not os.path.exists(path):
+        return None
+    current = AIModule()
+    try:
+        current.load_model(path)
+    except Exception as e:
+        print(f"Could not load current model {path}: {e}")
+        return None
+    X = X_test.reindex(columns=current.feature_names, fill_value=0)
+    y_pred = current.label_encoder.inverse_transform(current.model.predict(X.to_numpy()))
+    return _score(y_test, y_pred)
+
+
+def publish(model_dir, ai, metrics, watermark):
+    """Save a new model version and atomically point current.json at it"""
+    version = int(_read_current(model_dir).get('version', 0)) + 1
+    filename = f"model_v{version}.joblib"
+    trained_at = datetime.now().isoformat(timespec='seconds')
+    ai.save_model(os.path.join(model_dir, filename), version=version, metrics=metrics, trained_at=trained_at)
+    pointer = os.path.join(model_dir, CURRENT_POINTER)
+    with open(pointer + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'version': version, 'path': filename, 'metrics': metrics,
+                   'trained_at': trained_at, 'watermark': watermark}, f)
+    os.replace(pointer + '.tmp', pointer)
+    return version
+
+
+def _last_run(model_dir):
+    try:
+        with open(os.path.join(model_dir, RUNS_LOG), encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        return json.loads(lines[-1]) if lines else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _record_run(model_dir, run):
+    with open(os.path.join(model_dir, RUNS_LOG), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run) + '\n')
+
+
+def retrain(model_dir=None, chunk_size=None, n_jobs=None, min_improvement=None, force=False):
+    """Run one retraining pass; returns the run record.
+
+    peak_rss_mb is the peak of the calling process, so it covers this run alone
+    only in a fresh process; see retrain_in_subprocess.
+    """
+    model_dir = model_dir or Config.MODEL_DIR
+    chunk_size = chunk_size or Config.RETRAIN_CHUNK_SIZE
+    n_jobs = Config.RETRAIN_N_JOBS if n_jobs is None else n_jobs
+    min_improvement = Config.RETRAIN_MIN_IMPROVEMENT if min_improvement is None else min_improvement
+    os.makedirs(model_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    run = {'started_at': datetime.now().isoformat(timespec='seconds'), 'published': False}
+
+    # Training reads go to replicas when configured
+    def watermark(name, shard_router):
+        conn = shard_router.connect_read()
+        try:
+            return read_watermark(conn)
+        finally:
+            conn.close()
+
+    # Incremental: only load and retrain when labels changed on some shard
+    run['watermark'] = shards.scatter(watermark)
+    if not force and _last_run(model_dir).get('watermark') == run['watermark']:
+        run.update(status='skipped', reason='no label changes since last run')
+        return _finish_run(model_dir, run, started)
+
+    # Every shard holds whole patients, so per-patient trends can be computed on
+    # each shard independently; each patient is read only from the shard that owns it
+    def load(name, shard_router):
+        conn = shard_router.connect_read()
+        try:
+            return load_training_data(conn, chunk_size, shard=name)
+        finally:
+            conn.close()
+
+    frames = [loaded for loaded in shards.scatter(load).values() if loaded[0] is not None]
+    if frames:
+        X = pd.concat([frame for frame, _, _ in frames], ignore_index=True)
+        y = np.concatenate([labels for _, labels, _ in frames])
+        holdout = np.concatenate([mask for _, _, mask in frames])
+    else:
+        X, y, holdout = None, None, None
+    run['rows'] = 0 if X is None else int(len(X))
+    run['load_seconds'] = round(time.perf_counter() - started, 2)
+
+    if X is None or len(np.unique(y)) < 2:
+        run.update(status='skipped', reason='not enough labelled readings')
+    elif holdout.all() or not holdout.any() or len(np.unique(y[~holdout])) < 2:
+        run.update(status='skipped', reason='not enough labelled patients on both sides of the hold-out split')
+    else:
+        # The same patients are held out on every run, so neither model was trained on them
+        X_train, X_test = X[~holdout], X[holdout]
+        y_train, y_test = y[~holdout], y[holdout]
+        run['holdout_rows'] = int(holdout.sum())
+
+        # A full refit rather than warm_start: relabelled or deleted rows cannot be
+        # taken out of trees already grown, and a new diagnosis class changes the
+        # label encoding the existing trees were fit with
+        ai = AIModule()
+        ai.label_encoder = LabelEncoder().fit(y)
+        ai.feature_names = list(X.columns)
+        ai.model = RandomForestClassifier(
+            n_estimators=300,
+            max_depth=12,
+            min_samples_split=5,
+            min_samples_leaf=2,
+            random_state=42,
+            n_jobs=n_jobs
+        )
+        fit_started = time.perf_counter()
+        ai.model.fit(X_train.to_numpy(), ai.label_encoder.transform(y_train))
+        run['fit_seconds'] = round(time.perf_counter() - fit_started, 2)
+
+        candidate = _score(y_test, ai.label_encoder.inverse_transform(ai.model.predict(X_test.to_numpy())))
+        current = evaluate_current(model_dir, X_test, y_test)
+        run.update(candidate=candidate, current=current)
+
+        if current is None or candidate['f1_macro'] > current['f1_macro'] + min_improvement:
+            run['version'] = publish(model_dir, ai, candidate, run['watermark'])
+            run.update(status='published', published=True)
+        else:
+            run.update(status='rejected', reason='candidate did not beat the current model')
+
+    return _finish_run(model_dir, run, started)
+
+
+def _finish_run(model_dir, run, started):
+    run['total_seconds'] = round(time.perf_counter() - started, 2)
+    # ru_maxrss is reported in kilobytes on Linux
+    run['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    _record_run(model_dir, run)
+    return run
+
+
+def retrain_in_subprocess(*args):
+    """Run retrain() in a fresh process so its peak memory is measured for that run alone"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(retrain, *args).result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Retrain the disease model from vital_signs and publish it if it improves.')
+    parser.add_argument('--model-dir', default=Config.MODEL_DIR)
+    parser.add_argument('--chunk-size', type=int, default=Config.RETRAIN_CHUNK_SIZE)
+    parser.add_argument('--n-jobs', type=int, default=Config.RETRAIN_N_JOBS,
+                        help='Parallel tree building jobs (-1 uses every core)')
+    parser.add_argument('--min-improvement', type=float, default=Config.RETRAIN_MIN_IMPROVEMENT,
+                        help='Macro F1 gain required over the current model to publish')
+    parser.add_argument('--force', action='store_true', help='Retrain even if no new readings arrived')
+    parser.add_argument('--interval', type=int, default=0,
+                        help='Keep running, retraining every INTERVAL seconds')
+    args = parser.parse_args(argv)
+
+    while True:
+        try:
+            run = retrain_in_subprocess(args.model_dir, args.chunk_size, args.n_jobs, args.min_improvement, args.force)
+            print(json.dumps(run))
+        except Exception as e:
+            print(f"Error retraining model: {e}", file=sys.stderr)
+            if not args.interval:
+                return 1
+        if not args.interval:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
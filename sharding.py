@@ -0,0 +1,105 @@
+import bisect
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from db import DatabaseRouter
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class ConsistentHashRing:
+    """Map keys to shard names with consistent hashing.
+
+    Each shard owns ``vnodes`` points on the ring, so adding a shard only
+    moves roughly 1/N of the keys, all of them onto the new shard.
+    """
+
+    def __init__(self, names, vnodes=128):
+        self.names = list(names)
+        self._points = sorted(
+            (_hash(f'{name}#{i}'), name)
+            for name in self.names
+            for i in range(vnodes)
+        )
+        self._hashes = [point for point, _ in self._points]
+
+    def node_for(self, key):
+        if not self._points:
+            raise ValueError('No shards configured')
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._points)
+        return self._points[index][1]
+
+
+class ShardManager:
+    """Database routers for every shard plus the ring that assigns patients to them.
+
+    Shards marked ``'pending': True`` get a router (so tools can copy data to
+    them) but are left off the ring until a rebalance has finished.
+    """
+
+    def __init__(self, shard_configs, vnodes=128, include_pending=False):
+        self.configs = {shard['name']: shard for shard in shard_configs}
+        self.names = list(self.configs)
+        self.routers = {name: self._build_router(shard) for name, shard in self.configs.items()}
+        self.active = [name for name in self.names if include_pending or not self.configs[name].get('pending')]
+        self.ring = ConsistentHashRing(self.active, vnodes)
+
+    @staticmethod
+    def _build_router(shard):
+        return DatabaseRouter(
+            primary={
+                'host': shard.get('host', Config.MYSQL_HOST),
+                'port': shard.get('port', Config.MYSQL_PORT),
+                'user': shard.get('user', Config.MYSQL_USER),
+                'password': shard.get('password', Config.MYSQL_PASSWORD),
+            },
+            replicas=shard.get('replicas', []),
+            database=shard.get('database', Config.MYSQL_DB),
+            pin_seconds=Config.READ_YOUR_WRITES_SECONDS,
+            retry_after=Config.REPLICA_RETRY_SECONDS,
+            connect_timeout=Config.REPLICA_CONNECT_TIMEOUT,
+        )
+
+    def shard_for(self, registration_id):
+        return self.ring.node_for(registration_id)
+
+    def owns(self, name, registration_id):
+        """Whether the live ring places the patient on shard `name`.
+
+        Between switching a new shard on and `rebalance.py finish`, moved
+        patients are on both shards; readers that scatter skip the stale copy.
+        """
+        return self.shard_for(registration_id) == name
+
+    def router_for(self, registration_id):
+        return self.routers[self.shard_for(registration_id)]
+
+    def scatter(self, fn, names=None):
+        """Call fn(name, router) for every active shard in parallel; returns {name: result}"""
+        names = list(names or self.active)
+        if len(names) == 1:
+            return {names[0]: fn(names[0], self.routers[names[0]])}
+        with ThreadPoolExecutor(max_workers=len(names)) as pool:
+            futures = {name: pool.submit(fn, name, self.routers[name]) for name in names}
+            return {name: future.result() for name, future in futures.items()}
+
+
+def shard_configs():
+    """Configured shards, or a single shard built from the MYSQL_* settings"""
+    if Config.SHARDS:
+        return Config.SHARDS
+    return [{
+        'name': 'default',
+        'host': Config.MYSQL_HOST,
+        'port': Config.MYSQL_PORT,
+        'user': Config.MYSQL_USER,
+        'password': Config.MYSQL_PASSWORD,
+        'database': Config.MYSQL_DB,
+        'replicas': Config.MYSQL_REPLICAS,
+    }]
+
+
+shards = ShardManager(shard_configs(), vnodes=Config.SHARD_VIRTUAL_NODES)
@@ -0,0 +1,303 @@
+import argparse
+import hashlib
+import json
+import sys
+import time
+
+from config import Config
+from sharding import shards
+
+# Demographic columns that used to be repeated on every vital_signs row
+LEGACY_VITAL_COLUMNS = ('name', 'gender', 'age', 'comorbidities', 'medications')
+# Legacy columns created NOT NULL, and their nullable definitions
+LEGACY_NULLABLE_DEFINITIONS = {
+    'name': 'VARCHAR(100) NULL',
+    'gender': "ENUM('MALE', 'FEMALE') NULL",
+    'age': 'INT NULL',
+}
+
+# shard -> (checked_at, legacy columns present), see legacy_columns_cached
+_legacy_checked = {}
+
+
+def _as_list(value):
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('utf-8')
+    if isinstance(value, str):
+        try:
+            value = json.loads(value) if value else []
+        except ValueError:
+            value = [value]
+    return value or []
+
+
+def snapshot_fingerprint(name, gender, age, comorbidities, medications):
+    """Stable hash of the point-in-time demographics of a patient"""
+    payload = json.dumps(
+        [name, gender, int(age), _as_list(comorbidities), _as_list(medications)],
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def current_snapshot(cursor, registration_id):
+    """Return (snapshot_id, fingerprint) of a patient's current snapshot, if any"""
+    cursor.execute('''
+        SELECT s.id, s.fingerprint
+        FROM patients p
+        JOIN patient_snapshots s ON s.id = p.snapshot_id
+        WHERE p.registration_id = %s
+    ''', (registration_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None, None
+    if isinstance(row, dict):
+        return row['id'], row['fingerprint']
+    return row[0], row[1]
+
+
+def ensure_snapshot(cursor, registration_id, name, gender, age, comorbidities, medications,
+                    current_id=None, current_fingerprint=None, created_at=None):
+    """Return the snapshot id for these demographics, writing a row only if they changed.
+
+    Returns ``(snapshot_id, created)``.
+    """
+    fingerprint = snapshot_fingerprint(name, gender, age, comorbidities, medications)
+    if current_fingerprint is None:
+        current_id, current_fingerprint = current_snapshot(cursor, registration_id)
+    if current_id and current_fingerprint == fingerprint:
+        return current_id, False
+
+    cursor.execute('''
+        INSERT INTO patient_snapshots (
+            registration_id, name, gender, age, comorbidities, medications, fingerprint, created_at
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP))
+    ''', (
+        registration_id, name, gender, age,
+        json.dumps(_as_list(comorbidities)),
+        json.dumps(_as_list(medications)),
+        fingerprint,
+        created_at
+    ))
+    return cursor.lastrowid, True
+
+
+def _vital_columns(cursor, required_only=False):
+    cursor.execute(f'''
+        SELECT column_name AS name FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'vital_signs'
+        {"AND is_nullable = 'NO'" if required_only else ''}
+    ''')
+    return {(row['name'] if isinstance(row, dict) else row[0]).lower() for row in cursor.fetchall()}
+
+
+def legacy_columns_present(cursor):
+    columns = _vital_columns(cursor)
+    return [column for column in LEGACY_VITAL_COLUMNS if column in columns]
+
+
+def legacy_required_columns(cursor):
+    """Legacy columns still NOT NULL, which block inserting readings without demographics"""
+    columns = _vital_columns(cursor, required_only=True)
+    return [column for column in LEGACY_NULLABLE_DEFINITIONS if column in columns]
+
+
+def legacy_columns_cached(cursor, shard, recheck_after=60):
+    """legacy_columns_present for a shard, rechecked at most every recheck_after seconds"""
+    now = time.monotonic()
+    cached = _legacy_checked.get(shard)
+    # Once dropped the columns never come back, so an empty result is kept for good
+    if cached and (not cached[1] or now - cached[0] < recheck_after):
+        return cached[1]
+    present = legacy_columns_present(cursor)
+    _legacy_checked[shard] = (now, present)
+    return present
+
+
+def demographic_expressions(legacy, snapshot='s', vital='v', patient='p'):
+    """SQL for each demographic column: the snapshot taken at reading time, else the value
+    still on a not yet backfilled vital_signs row, else the current patient record"""
+    return {
+        column: (f'COALESCE({snapshot}.{column}, {vital}.{column}, {patient}.{column})' if column in legacy
+                 else f'COALESCE({snapshot}.{column}, {patient}.{column})')
+        for column in LEGACY_VITAL_COLUMNS
+    }
+
+
+def relax_legacy_columns(conn):
+    """Make the NOT NULL legacy columns nullable so readings can be written without them"""
+    cursor = conn.cursor()
+    try:
+        required = legacy_required_columns(cursor)
+        if not required:
+            return False
+        changes = ', '.join(f'MODIFY COLUMN {column} {LEGACY_NULLABLE_DEFINITIONS[column]}' for column in required)
+        cursor.execute(f'ALTER TABLE vital_signs {changes}, ALGORITHM=INPLACE, LOCK=NONE')
+        print(f"Made vital_signs columns nullable: {', '.join(required)}")
+        return True
+    finally:
+        cursor.close()
+
+
+def backfill_vitals(conn, batch_size, pause=0.0):
+    """Attach a snapshot to every vital_signs row that predates the split.
+
+    Works in primary-key order in small committed batches so writers are never
+    blocked for long, and is safe to stop and re-run at any point.
+    """
+    cursor = conn.cursor(dictionary=True)
+    # (registration_id, fingerprint) -> snapshot id, for the batch being processed
+    known = {}
+    last_id = 0
+    total = 0
+    try:
+        while True:
+            cursor.execute('''
+                SELECT id, registration_id, name, gender, age, comorbidities, medications, created_at
+                FROM vital_signs
+                WHERE snapshot_id IS NULL AND id > %s
+                ORDER BY id
+                LIMIT %s
+            ''', (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for row in rows:
+                if row['name'] is None:
+                    # Written by the new code path without demographics; nothing to copy
+                    continue
+                fingerprint = snapshot_fingerprint(
+                    row['name'], row['gender'], row['age'], row['comorbidities'], row['medications']
+                )
+                key = (row['registration_id'], fingerprint)
+                if key not in known:
+                    cursor.execute('''
+                        SELECT id FROM patient_snapshots
+                        WHERE registration_id = %s AND fingerprint = %s
+                        ORDER BY id LIMIT 1
+                    ''', key)
+                    existing = cursor.fetchone()
+                    if existing:
+                        known[key] = existing['id']
+                    else:
+                        known[key], _ = ensure_snapshot(
+                            cursor, row['registration_id'], row['name'], row['gender'], row['age'],
+                            row['comorbidities'], row['medications'],
+                            current_fingerprint='', created_at=row['created_at']
+                        )
+                updates.append((known[key], row['id']))
+
+            if updates:
+                cursor.executemany('UPDATE vital_signs SET snapshot_id = %s WHERE id = %s', updates)
+            conn.commit()
+            total += len(updates)
+            last_id = rows[-1]['id']
+            known.clear()
+            print(f"Backfilled {total} vital sign rows (up to id {last_id})")
+            if pause:
+                time.sleep(pause)
+    finally:
+        cursor.close()
+    return total
+
+
+def backfill_patients(conn, batch_size):
+    """Point every patient at a snapshot of their current demographics"""
+    cursor = conn.cursor(dictionary=True)
+    total = 0
+    try:
+        while True:
+            cursor.execute('''
+                SELECT registration_id, name, gender, age, comorbidities, medications
+                FROM patients
+                WHERE snapshot_id IS NULL
+                LIMIT %s
+            ''', (batch_size,))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            for row in rows:
+                fingerprint = snapshot_fingerprint(
+                    row['name'], row['gender'], row['age'], row['comorbidities'], row['medications']
+                )
+                cursor.execute('''
+                    SELECT id FROM patient_snapshots
+                    WHERE registration_id = %s AND fingerprint = %s
+                    ORDER BY id DESC LIMIT 1
+                ''', (row['registration_id'], fingerprint))
+                existing = cursor.fetchone()
+                if existing:
+                    snapshot_id = existing['id']
+                else:
+                    snapshot_id, _ = ensure_snapshot(
+                        cursor, row['registration_id'], row['name'], row['gender'], row['age'],
+                        row['comorbidities'], row['medications'], current_fingerprint=''
+                    )
+                cursor.execute('UPDATE patients SET snapshot_id = %s WHERE registration_id = %s',
+                               (snapshot_id, row['registration_id']))
+            conn.commit()
+            total += len(rows)
+    finally:
+        cursor.close()
+    print(f"Linked {total} patients to snapshots")
+    return total
+
+
+def drop_legacy_columns(conn):
+    """Drop the denormalized columns once every reading has a snapshot"""
+    cursor = conn.cursor()
+    try:
+        present = legacy_columns_present(cursor)
+        if not present:
+            print("Legacy columns already dropped")
+            return False
+        cursor.execute('SELECT COUNT(*) FROM vital_signs WHERE snapshot_id IS NULL')
+        remaining = cursor.fetchone()[0]
+        if remaining:
+            print(f"Refusing to drop columns: {remaining} vital sign rows have no snapshot yet")
+            return False
+        drops = ', '.join(f'DROP COLUMN {column}' for column in present)
+        cursor.execute(f'ALTER TABLE vital_signs {drops}, ALGORITHM=INPLACE, LOCK=NONE')
+        print(f"Dropped columns from vital_signs: {', '.join(present)}")
+        return True
+    finally:
+        cursor.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Backfill patient_snapshots from denormalized vital_signs columns, then drop them.'
+    )
+    parser.add_argument('--batch-size', type=int, default=Config.SNAPSHOT_BACKFILL_BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=0.0,
+                        help='Seconds to sleep between batches to limit load on the primary')
+    parser.add_argument('--prepare', action='store_true',
+                        help='Only make the legacy columns nullable; run this before starting the new app version')
+    parser.add_argument('--drop-columns', action='store_true',
+                        help='Drop the legacy name/gender/age/comorbidities/medications columns after backfilling')
+    args = parser.parse_args(argv)
+
+    for name in shards.names:
+        print(f"Shard {name}:")
+        conn = shards.routers[name].connect_primary()
+        try:
+            relax_legacy_columns(conn)
+            if args.prepare:
+                continue
+            cursor = conn.cursor()
+            present = legacy_columns_present(cursor)
+            cursor.close()
+            if present:
+                backfill_vitals(conn, args.batch_size, pause=args.pause)
+            backfill_patients(conn, args.batch_size)
+            if args.drop_columns:
+                drop_legacy_columns(conn)
+        finally:
+            conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
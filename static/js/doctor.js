@@ -1,52 +1,164 @@
-// Placeholder for future interactivity (e.g., filtering, sorting patients)
 console.log('Doctor Dashboard loaded.');
 
 // Initialize Bootstrap modal
 const historyModal = new bootstrap.Modal(document.getElementById('historyModal'));
 
-// Search and filter functionality
-document.getElementById('searchInput').addEventListener('input', filterPatients);
-document.getElementById('filterStatus').addEventListener('change', filterPatients);
-document.getElementById('sortBy').addEventListener('change', sortPatients);
+// Virtualized patient list: only the rows in view are in the DOM, and pages
+// of patients are fetched from /api/patients as they scroll into view.
+const ROW_HEIGHT = 132;
+// Requested page size; the server may clamp it, so indexing uses listState.pageSize
+const PAGE_SIZE = 50;
+const OVERSCAN_ROWS = 5;
 
-function filterPatients() {
-    const searchTerm = document.getElementById('searchInput').value.toLowerCase();
-    const statusFilter = document.getElementById('filterStatus').value;
-    const patientCards = document.querySelectorAll('.patient-card');
+const patientList = document.getElementById('patient-list');
+const patientSpacer = document.getElementById('patient-list-spacer');
+const listState = {
+    total: 0,
+    pageSize: PAGE_SIZE,
+    pages: new Map(),
+    pending: new Map(),
+    generation: 0
+};
 
-    patientCards.forEach(card => {
-        const patientName = card.querySelector('h3').textContent.toLowerCase();
-        const patientStatus = card.dataset.status;
-        const matchesSearch = patientName.includes(searchTerm);
-        const matchesStatus = statusFilter === 'all' || patientStatus === statusFilter;
+document.getElementById('searchInput').addEventListener('input', debounce(resetPatientList, 250));
+document.getElementById('filterStatus').addEventListener('change', resetPatientList);
+document.getElementById('sortBy').addEventListener('change', resetPatientList);
+patientList.addEventListener('scroll', () => window.requestAnimationFrame(renderVisibleRows));
+window.addEventListener('resize', () => window.requestAnimationFrame(renderVisibleRows));
 
-        card.closest('.col-md-6').style.display = matchesSearch && matchesStatus ? 'block' : 'none';
+function debounce(fn, wait) {
+    let timer = null;
+    return (...args) => {
+        clearTimeout(timer);
+        timer = setTimeout(() => fn(...args), wait);
+    };
+}
+
+function escapeHtml(value) {
+    return String(value ?? '')
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#39;');
+}
+
+function currentQuery() {
+    return new URLSearchParams({
+        q: document.getElementById('searchInput').value.trim(),
+        status: document.getElementById('filterStatus').value,
+        sort: document.getElementById('sortBy').value,
+        page_size: listState.pageSize
     });
 }
 
-function sortPatients() {
-    const sortBy = document.getElementById('sortBy').value;
-    const patientList = document.getElementById('patient-list');
-    const patientCards = Array.from(patientList.getElementsByClassName('col-md-6'));
-
-    patientCards.sort((a, b) => {
-        const cardA = a.querySelector('.patient-card');
-        const cardB = b.querySelector('.patient-card');
-
-        switch (sortBy) {
-            case 'name':
-                return cardA.querySelector('h3').textContent.localeCompare(cardB.querySelector('h3').textContent);
-            case 'critical':
-                return cardB.dataset.status.localeCompare(cardA.dataset.status);
-            case 'recent':
-            default:
-                const dateA = new Date(cardA.querySelector('.vital-signs p:last-child').textContent.split(': ')[1]);
-                const dateB = new Date(cardB.querySelector('.vital-signs p:last-child').textContent.split(': ')[1]);
-                return dateB - dateA;
+function fetchPage(page) {
+    if (listState.pages.has(page)) return Promise.resolve(listState.pages.get(page));
+    if (listState.pending.has(page)) return listState.pending.get(page);
+
+    const generation = listState.generation;
+    const params = currentQuery();
+    params.set('page', page);
+    const request = fetch(`/api/patients?${params}`)
+        .then(response => response.json())
+        .then(data => {
+            // Ignore responses for a search/filter that has since changed
+            if (generation !== listState.generation) return null;
+            if (data.error) throw new Error(data.error);
+            // Only page 0 carries the match count and the page size the server applied
+            if (page === 0) {
+                listState.total = data.total;
+                listState.pageSize = data.page_size;
+            }
+            listState.pages.set(page, data.patients);
+            return data.patients;
+        })
+        .finally(() => {
+            if (generation === listState.generation) listState.pending.delete(page);
+        });
+    listState.pending.set(page, request);
+    return request;
+}
+
+function resetPatientList() {
+    listState.generation += 1;
+    listState.pageSize = PAGE_SIZE;
+    listState.pages.clear();
+    listState.pending.clear();
+    patientList.scrollTop = 0;
+    fetchPage(0)
+        .then(() => renderVisibleRows())
+        .catch(error => {
+            console.error('Error fetching patients:', error);
+            document.getElementById('patient-count').textContent = 'Error loading patients';
+        });
+}
+
+function getPatient(index) {
+    const rows = listState.pages.get(Math.floor(index / listState.pageSize));
+    return rows ? rows[index % listState.pageSize] : undefined;
+}
+
+function getPatientStatusBadge(status) {
+    switch (status) {
+        case 'critical': return '<span class="badge bg-danger">Critical</span>';
+        case 'warning': return '<span class="badge bg-warning">Warning</span>';
+        default: return '<span class="badge bg-success">Normal</span>';
+    }
+}
+
+function renderPatientRow(patient, index) {
+    if (!patient) {
+        return `<div class="patient-row patient-row-loading" style="top: ${index * ROW_HEIGHT}px">Loading...</div>`;
+    }
+    const firstAlert = patient.alerts.length ? patient.alerts[0] : '';
+    return `
+        <div class="patient-row patient-card" data-status="${escapeHtml(patient.status)}" style="top: ${index * ROW_HEIGHT}px">
+            <div class="d-flex justify-content-between align-items-center">
+                <h3>${escapeHtml(patient.name)} (ID: ${escapeHtml(patient.registration_id)})</h3>
+                ${getPatientStatusBadge(patient.status)}
+            </div>
+            <p class="mb-1">
+                <strong>Age:</strong> ${escapeHtml(patient.age)} | <strong>Gender:</strong> ${escapeHtml(patient.gender)} |
+                <strong>Last Updated:</strong> ${escapeHtml(patient.last_vital_at)} |
+                <strong>Risk:</strong> <span class="badge bg-${getRiskLevelColor(patient.risk_level)}">${escapeHtml(patient.risk_level)}</span>
+            </p>
+            <p class="patient-row-alert mb-1 ${firstAlert.includes('Critical') ? 'text-danger' : 'text-warning'}">
+                ${escapeHtml(firstAlert)}${patient.alerts.length > 1 ? ` (+${patient.alerts.length - 1} more)` : ''}
+            </p>
+            <button class="btn btn-sm btn-info" onclick="showVitalDetails(getPatient(${index}))">View Details</button>
+            <button class="btn btn-sm btn-primary" onclick="viewPatientHistory('${escapeHtml(patient.registration_id)}')">View History</button>
+        </div>
+    `;
+}
+
+function renderVisibleRows() {
+    patientSpacer.style.height = `${listState.total * ROW_HEIGHT}px`;
+    document.getElementById('patient-count').textContent =
+        `${listState.total} patient${listState.total === 1 ? '' : 's'}`;
+
+    const first = Math.max(Math.floor(patientList.scrollTop / ROW_HEIGHT) - OVERSCAN_ROWS, 0);
+    const last = Math.min(
+        Math.ceil((patientList.scrollTop + patientList.clientHeight) / ROW_HEIGHT) + OVERSCAN_ROWS,
+        listState.total
+    );
+
+    // Fetch any pages in the visible window that are not loaded yet
+    const firstPage = Math.floor(first / listState.pageSize);
+    const lastPage = Math.floor(Math.max(last - 1, 0) / listState.pageSize);
+    for (let page = firstPage; page <= lastPage; page++) {
+        if (!listState.pages.has(page) && !listState.pending.has(page)) {
+            fetchPage(page)
+                .then(rows => { if (rows) renderVisibleRows(); })
+                .catch(error => console.error('Error fetching patients:', error));
         }
-    });
+    }
 
-    patientCards.forEach(card => patientList.appendChild(card));
+    const rows = [];
+    for (let index = first; index < last; index++) {
+        rows.push(renderPatientRow(getPatient(index), index));
+    }
+    patientSpacer.innerHTML = rows.join('');
 }
 
 // View patient history
@@ -220,11 +332,21 @@ function getTrendColor(trend) {
     return 'info';
 }
 
-// Auto-refresh dashboard every 5 minutes
+// Refresh the patient list every 5 minutes, keeping the scroll position
 setInterval(() => {
-    window.location.reload();
+    const scrollTop = patientList.scrollTop;
+    listState.generation += 1;
+    listState.pages.clear();
+    listState.pending.clear();
+    patientList.scrollTop = scrollTop;
+    // Page 0 refreshes the total; the visible pages are fetched by the render
+    fetchPage(0)
+        .then(() => renderVisibleRows())
+        .catch(error => console.error('Error refreshing patients:', error));
 }, 300000);
 
+resetPatientList();
+
 // Initialize tooltips
 document.addEventListener('DOMContentLoaded', function() {
     const tooltipTriggerList = [].slice.call(document.querySelectorAll('[data-bs-toggle="tooltip"]'));
@@ -0,0 +1,59 @@
+import unittest
+from datetime import datetime, timedelta
+
+from dashboard import PATIENT_STATUSES, merge_patient_pages
+
+NOW = datetime(2024, 1, 1, 12, 0)
+
+
+def patient(registration_id, name, status, minutes_ago):
+    return {
+        'registration_id': registration_id,
+        'name': name,
+        'status': status,
+        'last_vital_at': NOW - timedelta(minutes=minutes_ago),
+    }
+
+
+# Two shards, each already in the order its ORDER BY returns
+SHARD_1 = [
+    patient('P001', 'alice', 'critical', 5),
+    patient('P003', 'Carol', 'normal', 1),
+    patient('P005', 'eve', 'warning', 5),
+]
+SHARD_2 = [
+    patient('P002', 'Bob', 'warning', 2),
+    patient('P004', 'dave', 'critical', 5),
+    patient('P006', 'Frank', 'normal', 30),
+]
+
+
+def ids(rows):
+    return [row['registration_id'] for row in rows]
+
+
+class MergePatientPagesTest(unittest.TestCase):
+    def merge(self, sort, page=0, page_size=10):
+        return merge_patient_pages([SHARD_1, SHARD_2], sort, page, page_size)
+
+    def test_recent_is_newest_first_with_id_descending_ties(self):
+        self.assertEqual(ids(self.merge('recent')), ['P003', 'P002', 'P005', 'P004', 'P001', 'P006'])
+
+    def test_name_ignores_case(self):
+        self.assertEqual(ids(self.merge('name')), ['P001', 'P002', 'P003', 'P004', 'P005', 'P006'])
+
+    def test_critical_groups_by_status_then_recent(self):
+        rows = self.merge('critical')
+        self.assertEqual(ids(rows), ['P004', 'P001', 'P002', 'P005', 'P003', 'P006'])
+        statuses = [PATIENT_STATUSES.index(row['status']) for row in rows]
+        self.assertEqual(statuses, sorted(statuses))
+
+    def test_pages_are_sliced_after_merging(self):
+        full = ids(self.merge('recent'))
+        pages = [ids(self.merge('recent', page=page, page_size=2)) for page in range(3)]
+        self.assertEqual(pages, [full[0:2], full[2:4], full[4:6]])
+        self.assertEqual(self.merge('recent', page=3, page_size=2), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+from unittest import mock
+
+from patient_cache import PatientCache
+
+
+class FakeCursor:
+    """Dictionary cursor over an in-memory patients table"""
+
+    def __init__(self, patients):
+        self.patients = patients
+        self.queries = []
+        self._result = None
+
+    def execute(self, query, params):
+        self.queries.append(query)
+        row = self.patients.get(params[0])
+        if row is None:
+            self._result = None
+        elif query.strip().startswith('SELECT version'):
+            self._result = {'version': row['version'], 'last_vital_id': row['last_vital_id']}
+        else:
+            self._result = dict(row)
+
+    def fetchone(self):
+        return self._result
+
+
+def patient(registration_id, version=1, last_vital_id=1, **fields):
+    return {'registration_id': registration_id, 'version': version, 'last_vital_id': last_vital_id,
+            'name': 'Ann', 'snapshot_fingerprint': 'abc', **fields}
+
+
+class PatientCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('patient_cache.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cursor = FakeCursor({'P1': patient('P1'), 'P2': patient('P2'), 'P3': patient('P3')})
+        self.cache = PatientCache(max_entries=2, ttl=30)
+
+    def test_miss_then_hit_within_ttl(self):
+        self.assertEqual(self.cache.lookup(self.cursor, 'P1')['name'], 'Ann')
+        self.assertEqual(self.cache.lookup(self.cursor, 'P1')['name'], 'Ann')
+        self.assertEqual(len(self.cursor.queries), 1)
+        self.assertEqual((self.cache.stats()['misses'], self.cache.stats()['hits']), (1, 1))
+
+    def test_unknown_patient_is_not_cached(self):
+        self.assertIsNone(self.cache.lookup(self.cursor, 'P9'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_expired_entry_is_revalidated(self):
+        self.cache.lookup(self.cursor, 'P1')
+        self.now += 31
+        self.cache.lookup(self.cursor, 'P1')
+        self.assertTrue(self.cursor.queries[-1].strip().startswith('SELECT version'))
+        self.assertEqual(self.cache.stats()['revalidations'], 1)
+        # Revalidating restarts the TTL
+        self.now += 10
+        self.cache.lookup(self.cursor, 'P1')
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_changed_version_or_reading_reloads(self):
+        self.cache.lookup(self.cursor, 'P1')
+        self.cursor.patients['P1'] = patient('P1', version=2, name='Anne')
+        self.now += 31
+        self.assertEqual(self.cache.lookup(self.cursor, 'P1')['name'], 'Anne')
+
+        self.cursor.patients['P1'] = patient('P1', version=2, last_vital_id=7, name='Anne')
+        self.now += 31
+        self.assertEqual(self.cache.lookup(self.cursor, 'P1')['last_vital_id'], 7)
+        self.assertEqual(self.cache.stats()['invalidations'], 2)
+
+    def test_lru_eviction(self):
+        self.cache.lookup(self.cursor, 'P1')
+        self.cache.lookup(self.cursor, 'P2')
+        self.cache.lookup(self.cursor, 'P1')  # P2 is now least recently used
+        self.cache.lookup(self.cursor, 'P3')
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertIsNotNone(self.cache.get('P1')[0])
+        self.assertIsNone(self.cache.get('P2')[0])
+
+    def test_update_keeps_entry_invalidate_drops_it(self):
+        self.cache.lookup(self.cursor, 'P1')
+        self.cache.update('P1', last_vital_id=5, last_risk_level='HIGH')
+        row = self.cache.lookup(self.cursor, 'P1')
+        self.assertEqual((row['last_vital_id'], row['last_risk_level']), (5, 'HIGH'))
+        self.assertEqual(len(self.cursor.queries), 1)
+
+        self.cache.invalidate('P1')
+        self.assertIsNone(self.cache.get('P1')[0])
+        self.cache.lookup(self.cursor, 'P1')
+        self.assertEqual(len(self.cursor.queries), 2)
+
+    def test_returned_rows_are_copies(self):
+        self.cache.lookup(self.cursor, 'P1').pop('snapshot_fingerprint')
+        self.assertIn('snapshot_fingerprint', self.cache.lookup(self.cursor, 'P1'))
+
+    def test_replica_rows_are_revalidated_before_lookup_trusts_them(self):
+        replica = FakeCursor({'P1': patient('P1', version=1)})
+        self.assertEqual(self.cache.read(replica, 'P1')['version'], 1)
+        # Readers may use the unverified row within its TTL
+        self.cache.read(replica, 'P1')
+        self.assertEqual(len(replica.queries), 1)
+
+        # The primary has moved on; lookup must not serve the replica's version
+        self.cursor.patients['P1'] = patient('P1', version=3)
+        self.assertEqual(self.cache.lookup(self.cursor, 'P1')['version'], 3)
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+    def test_replica_row_verified_by_lookup(self):
+        self.cache.read(FakeCursor({'P1': patient('P1')}), 'P1')
+        self.cache.lookup(self.cursor, 'P1')
+        self.cache.lookup(self.cursor, 'P1')
+        self.assertEqual(self.cache.stats()['revalidations'], 1)
+        self.assertEqual(len(self.cursor.queries), 1)
+
+    def test_read_bypass_skips_cached_row(self):
+        self.cache.lookup(self.cursor, 'P1')
+        self.cursor.patients['P1'] = patient('P1', last_vital_id=9)
+        self.assertEqual(self.cache.read(self.cursor, 'P1')['last_vital_id'], 1)
+        self.assertEqual(self.cache.read(self.cursor, 'P1', bypass=True)['last_vital_id'], 9)
+
+    def test_disabled_cache(self):
+        cache = PatientCache(max_entries=0, ttl=30)
+        cache.lookup(self.cursor, 'P1')
+        cache.lookup(self.cursor, 'P1')
+        self.assertEqual(len(self.cursor.queries), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
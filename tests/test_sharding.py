@@ -0,0 +1,74 @@
+import unittest
+from collections import Counter
+
+from sharding import ConsistentHashRing, ShardManager
+
+KEYS = [f'P{i:05d}' for i in range(20000)]
+
+
+class ConsistentHashRingTest(unittest.TestCase):
+    def test_same_key_same_shard(self):
+        ring = ConsistentHashRing(['s1', 's2', 's3'])
+        self.assertEqual([ring.node_for(key) for key in KEYS[:100]],
+                         [ring.node_for(key) for key in KEYS[:100]])
+
+    def test_adding_a_shard_only_moves_keys_onto_it(self):
+        before = ConsistentHashRing(['s1', 's2'])
+        after = ConsistentHashRing(['s1', 's2', 's3'])
+        moved = [key for key in KEYS if before.node_for(key) != after.node_for(key)]
+        self.assertTrue(moved)
+        self.assertEqual({after.node_for(key) for key in moved}, {'s3'})
+        # Roughly 1/3 of the keys move to the third shard
+        self.assertAlmostEqual(len(moved) / len(KEYS), 1 / 3, delta=0.08)
+
+    def test_load_is_roughly_even(self):
+        names = ['s1', 's2', 's3', 's4']
+        ring = ConsistentHashRing(names, vnodes=128)
+        counts = Counter(ring.node_for(key) for key in KEYS)
+        self.assertEqual(set(counts), set(names))
+        expected = len(KEYS) / len(names)
+        for name in names:
+            self.assertLess(abs(counts[name] - expected) / expected, 0.25, counts)
+
+    def test_no_shards(self):
+        with self.assertRaises(ValueError):
+            ConsistentHashRing([]).node_for('P00001')
+
+
+class ShardManagerTest(unittest.TestCase):
+    CONFIGS = [
+        {'name': 's1', 'database': 'vitals_s1'},
+        {'name': 's2', 'database': 'vitals_s2'},
+        {'name': 's3', 'database': 'vitals_s3', 'pending': True},
+    ]
+
+    def test_pending_shards_get_routers_but_no_keys(self):
+        shards = ShardManager(self.CONFIGS)
+        self.assertEqual(shards.names, ['s1', 's2', 's3'])
+        self.assertEqual(shards.active, ['s1', 's2'])
+        self.assertIn('s3', shards.routers)
+        self.assertNotIn('s3', {shards.shard_for(key) for key in KEYS[:2000]})
+
+    def test_future_ring_matches_ring_after_switch_over(self):
+        future = ShardManager(self.CONFIGS, include_pending=True)
+        live = ShardManager([dict(shard, pending=False) for shard in self.CONFIGS])
+        self.assertEqual([future.shard_for(key) for key in KEYS[:2000]],
+                         [live.shard_for(key) for key in KEYS[:2000]])
+
+    def test_old_shard_stops_owning_moved_keys_after_switch_over(self):
+        before = ShardManager(self.CONFIGS)
+        live = ShardManager([dict(shard, pending=False) for shard in self.CONFIGS])
+        moved = [key for key in KEYS[:2000] if live.owns('s3', key)]
+        self.assertTrue(moved)
+        for key in moved:
+            self.assertTrue(before.owns(before.shard_for(key), key))
+            self.assertFalse(live.owns(before.shard_for(key), key))
+
+    def test_scatter_calls_every_active_shard(self):
+        shards = ShardManager(self.CONFIGS)
+        results = shards.scatter(lambda name, router: router.database)
+        self.assertEqual(results, {'s1': 'vitals_s1', 's2': 'vitals_s2'})
+
+
+if __name__ == '__main__':
+    unittest.main()